@@ -0,0 +1,4 @@
+# asgi.py, served by any ASGI server: uvicorn asgi:app
+from flaskr.asgi import create_asgi_app
+
+app = create_asgi_app()
@@ -0,0 +1,422 @@
+# benchmark.py
+"""
+Load and latency benchmark of the trivia API.
+
+Seeds a synthetic question bank of --size questions in the benchmark
+database (BENCH_DB_NAME, created from trivia.psql), then drives the
+listing, category, search and quiz endpoints through the Flask test
+client and/or a real HTTP server with --concurrency threads and
+reports p50/p99 latency, throughput, SQL queries per request and
+peak RSS. --save stores the results as a baseline, --compare fails
+the run (exit status 1) when a result regressed beyond --tolerance.
+
+    createdb trivia_bench && psql trivia_bench < trivia.psql
+    python benchmark.py --size 100000 --save baseline.json
+    python benchmark.py --size 100000 --compare baseline.json
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from flaskr import create_app
+from flaskr.bulk import import_questions
+from flaskr.pagination import QUESTIONS_PER_PAGE
+from models import setup_db, db, Category, Question
+
+SIZES = (1000, 100000, 1000000)
+MODES = ('client', 'http')
+SCENARIOS = ('list_page', 'list_category', 'search', 'quiz')
+
+# words of the synthetic questions, and the search terms
+WORDS = (
+    'river', 'mountain', 'painter', 'novel', 'planet', 'empire', 'album',
+    'stadium', 'element', 'battle', 'ocean', 'capital', 'composer',
+    'island', 'league', 'theory', 'dynasty', 'desert', 'film', 'medal'
+)
+
+
+"""
+count_queries
+    number of SQL statements run by this process, read before and
+    after a scenario to get its queries per request
+"""
+_queries = [0]
+_queries_lock = threading.Lock()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def count_queries(connection, cursor, statement, parameters, context,
+                  executemany):
+    with _queries_lock:
+        _queries[0] += 1
+
+
+def seed_questions(app, size, seed=0):
+    """
+    seed_questions(app, size, seed)
+        replaces the questions of the database with size synthetic
+        ones spread over its categories, keeping them when there are
+        already size questions
+    """
+    with app.app_context():
+        if Question.query.count() == size:
+            return
+
+        categories = list(Category.get_map())
+        rng = random.Random(seed)
+
+        def rows():
+            for number in range(1, size + 1):
+                words = rng.sample(WORDS, 4)
+                yield number, {
+                    'question': f'Question {number}: which {" ".join(words)}?',
+                    'answer': f'{words[0]} {number}',
+                    'category': rng.choice(categories),
+                    'difficulty': rng.randint(1, 5)
+                }
+
+        db.session.execute(f'DELETE FROM {Question.__tablename__}')
+        db.session.commit()
+        report = import_questions(rows(), batch_size=10000)
+        if report['failed']:
+            raise RuntimeError(f'Seeding failed: {report["errors"][:5]}')
+
+
+def build_requests(app, scenario, count, seed=0):
+    """
+    build_requests(app, scenario, count, seed)
+        returns count (method, path, body) requests of a scenario,
+        the same ones for the same database and seed
+    """
+    with app.app_context():
+        # the real ids, they do not start at 1 once the table was
+        # emptied by seed_questions
+        ids = [
+            id for id, in db.session.query(Question.id).order_by(Question.id)
+        ]
+        categories = list(Category.get_map())
+    total = len(ids)
+    rng = random.Random(f'{scenario}:{seed}')
+    pages = max(1, -(-total // QUESTIONS_PER_PAGE))
+
+    requests = []
+    for _ in range(count):
+        if scenario == 'list_page':
+            requests.append(
+                ('GET', f'/questions?page={rng.randint(1, pages)}', None)
+            )
+        elif scenario == 'list_category':
+            requests.append((
+                'GET',
+                f'/categories/{rng.choice(categories)}/questions?page=1',
+                None
+            ))
+        elif scenario == 'search':
+            requests.append((
+                'POST',
+                '/questions',
+                {'searchTerm': rng.choice(WORDS)}
+            ))
+        elif scenario == 'quiz':
+            requests.append(('POST', '/quizzes', {
+                'quiz_category': {'id': rng.choice(categories + [0])},
+                'previous_questions': rng.sample(
+                    ids,
+                    min(total, rng.randint(0, 10))
+                )
+            }))
+        else:
+            raise ValueError(f'Unknown scenario: {scenario}')
+    return requests
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def client_sender(app):
+    """
+    returns send(method, path, body) -> status, through the Flask
+    test client
+    """
+    def send(method, path, body):
+        response = app.test_client().open(path, method=method, json=body)
+        response.get_data()
+        return response.status_code
+    return send
+
+
+def http_sender(base_url):
+    """
+    returns send(method, path, body) -> status, over HTTP
+    """
+    def send(method, path, body):
+        data = None
+        headers = {}
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(
+            base_url + path,
+            data=data,
+            method=method,
+            headers=headers
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status
+        except HTTPError as error:
+            return error.code
+    return send
+
+
+def run_scenario(send, requests, concurrency):
+    """
+    run_scenario(send, requests, concurrency)
+        sends the requests from concurrency threads, returns the
+        latency percentiles (ms), the throughput (requests/s), the
+        SQL queries per request and the number of errors
+    """
+    def timed(request):
+        start = time.perf_counter()
+        status = send(*request)
+        return time.perf_counter() - start, status
+
+    queries = _queries[0]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(timed, requests))
+    elapsed = time.perf_counter() - start
+    queries = _queries[0] - queries
+
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'throughput': round(len(requests) / elapsed, 1),
+        'queries_per_request': round(queries / len(requests), 2),
+        'errors': sum(1 for _, status in results if status >= 400)
+    }
+
+
+def percentile(values, percent):
+    """
+    returns the nearest-rank percentile of sorted values
+    """
+    if not values:
+        return 0
+    rank = max(0, -(-len(values) * percent // 100) - 1)
+    return values[int(rank)]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return round(peak / 1024, 1)
+
+
+def run_benchmark(app, modes=MODES, scenarios=SCENARIOS, requests=1000,
+                  concurrency=8, warmup=50, seed=0):
+    """
+    run_benchmark(app, modes, scenarios, requests, concurrency, warmup,
+                  seed)
+        returns {mode: {scenario: results}} and 'peak_rss_mb'
+    """
+    results = {}
+    server = None
+    try:
+        for mode in modes:
+            if mode == 'http':
+                server = make_server(
+                    '127.0.0.1',
+                    0,
+                    app,
+                    threaded=True,
+                    request_handler=QuietRequestHandler
+                )
+                threading.Thread(target=server.serve_forever,
+                                 daemon=True).start()
+                send = http_sender(f'http://127.0.0.1:{server.server_port}')
+            else:
+                send = client_sender(app)
+
+            results[mode] = {}
+            for scenario in scenarios:
+                planned = build_requests(app, scenario, warmup + requests,
+                                         seed)
+                # fill the caches and the pools first
+                run_scenario(send, planned[:warmup], concurrency)
+                results[mode][scenario] = run_scenario(
+                    send,
+                    planned[warmup:],
+                    concurrency
+                )
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    compare(results, baseline, tolerance)
+        returns the regressions of results against baseline: p99
+        latency or peak RSS higher, throughput lower by more than
+        tolerance (a fraction), more queries per request or new
+        errors
+    """
+    regressions = []
+    for mode, scenarios in results.items():
+        if mode == 'peak_rss_mb':
+            continue
+        for scenario, result in scenarios.items():
+            base = baseline.get(mode, {}).get(scenario)
+            if base is None:
+                continue
+            name = f'{mode}/{scenario}'
+            if result['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+                regressions.append(
+                    f'{name}: p99 {result["p99_ms"]} ms, '
+                    f'baseline {base["p99_ms"]} ms'
+                )
+            if result['throughput'] < base['throughput'] * (1 - tolerance):
+                regressions.append(
+                    f'{name}: {result["throughput"]} requests/s, '
+                    f'baseline {base["throughput"]}'
+                )
+            if result['queries_per_request'] > base['queries_per_request']:
+                regressions.append(
+                    f'{name}: {result["queries_per_request"]} queries per '
+                    f'request, baseline {base["queries_per_request"]}'
+                )
+            if result['errors'] > base['errors']:
+                regressions.append(
+                    f'{name}: {result["errors"]} errors, '
+                    f'baseline {base["errors"]}'
+                )
+
+    base_rss = baseline.get('peak_rss_mb')
+    if base_rss and results['peak_rss_mb'] > base_rss * (1 + tolerance):
+        regressions.append(
+            f'peak RSS {results["peak_rss_mb"]} MB, baseline {base_rss} MB'
+        )
+    return regressions
+
+
+def print_report(size, results):
+    print(f'{size} questions, peak RSS {results["peak_rss_mb"]} MB')
+    print(f'{"mode":<8}{"scenario":<15}{"p50 ms":>10}{"p99 ms":>10}'
+          f'{"req/s":>10}{"queries":>9}{"errors":>8}')
+    for mode, scenarios in results.items():
+        if mode == 'peak_rss_mb':
+            continue
+        for scenario, result in scenarios.items():
+            print(f'{mode:<8}{scenario:<15}{result["p50_ms"]:>10}'
+                  f'{result["p99_ms"]:>10}{result["throughput"]:>10}'
+                  f'{result["queries_per_request"]:>9}{result["errors"]:>8}')
+
+
+def parse_value(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the trivia API on a synthetic question bank.'
+    )
+    parser.add_argument('--size', type=int, default=SIZES[0],
+                        help=f'Questions to seed, e.g. {SIZES}.')
+    parser.add_argument('--mode', choices=MODES + ('both',), default='both')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='Scenario to run, all of them by default.')
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='Requests per scenario.')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--config', action='append', default=[],
+                        metavar='KEY=VALUE',
+                        help='App setting, e.g. RESPONSE_CACHE=false.')
+    parser.add_argument('--save', metavar='FILE',
+                        help='Store the results as the baseline.')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='Fail when the results regressed.')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    database_path = (
+        f'postgresql://{os.environ.get("DB_USER")}:'
+        f'{os.environ.get("DB_PASSWORD")}@{os.environ.get("DB_HOST")}:'
+        f'{os.environ.get("DB_PORT")}/'
+        f'{os.environ.get("BENCH_DB_NAME", "trivia_bench")}'
+    )
+    # the load comes from one client, so no rate limits by default
+    config = dict(
+        [('ADMISSION_CONTROL', False)] + [
+            (key, parse_value(value))
+            for key, value in (item.split('=', 1) for item in args.config)
+        ]
+    )
+    app = create_app(test_config=config)
+    setup_db(app, database_path)
+    seed_questions(app, args.size, args.seed)
+
+    results = run_benchmark(
+        app,
+        modes=MODES if args.mode == 'both' else (args.mode,),
+        scenarios=args.scenario or SCENARIOS,
+        requests=args.requests,
+        concurrency=args.concurrency,
+        seed=args.seed
+    )
+    print_report(args.size, results)
+
+    key = str(args.size)
+    if args.save:
+        baselines = {}
+        if os.path.exists(args.save):
+            with open(args.save) as file:
+                baselines = json.load(file)
+        baselines[key] = results
+        with open(args.save, 'w') as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file).get(key)
+        if baseline is None:
+            print(f'No baseline for {key} questions in {args.compare}.')
+            return 1
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,310 @@
+import hashlib
+import hmac
+import logging
+import os
+import pickle
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+"""
+Cache backends
+
+Every backend has the same interface:
+    get(key)                   the value or None
+    set(key, value, ttl=None)  stores the value, ttl in seconds
+    add(key, value, ttl=None)  stores only if the key is missing,
+                               returns True when stored
+    incr(key, ttl=None)        adds one to a counter and returns it,
+                               a missing counter starts at 1 and
+                               expires after ttl seconds
+    delete(key)
+    clear()                    drops every entry of this cache
+Values are any picklable object. Counters of incr() are only read
+through incr().
+A backend that cannot be reached does not fail the request: get()
+and add() answer as for a missing key, set() and delete() are
+skipped, and the error is logged. incr() raises it, the callers
+decide how to count without the backend.
+"""
+
+
+def create_cache(url='memory://', max_size=1024, secret=None):
+    """
+    create_cache(url, max_size, secret)
+        returns the backend for the url:
+        memory://                       LRUCache of at most max_size
+                                        entries
+        redis://host:port/db?prefix=p   RedisCache shared by every
+                                        process, its values signed
+                                        with secret
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == 'memory':
+        return LRUCache(max_size)
+    if parsed.scheme == 'redis':
+        query = dict(
+            part.split('=', 1) for part in parsed.query.split('&') if part
+        )
+        return RedisCache(
+            host=parsed.hostname or 'localhost',
+            port=parsed.port or 6379,
+            db=int(parsed.path.strip('/') or 0),
+            password=parsed.password,
+            prefix=query.get('prefix', 'trivia:'),
+            secret=secret
+        )
+    raise ValueError(f'Unsupported cache url: {url}')
+
+
+class LRUCache:
+    """
+    LRUCache
+        thread-safe in-process cache keeping the most recently used
+        entries, at most max_size of them
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        # key -> (expiry or None, value)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (
+                entry[0] is None or entry[0] >= time.monotonic()
+            ):
+                return False
+            self._set(key, value, ttl)
+            return True
+
+    def incr(self, key, ttl=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (
+                entry[0] is not None and entry[0] < time.monotonic()
+            ):
+                self._set(key, 1, ttl)
+                return 1
+            self._entries[key] = (entry[0], entry[1] + 1)
+            self._entries.move_to_end(key)
+            return entry[1] + 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _set(self, key, value, ttl):
+        expiry = time.monotonic() + ttl if ttl else None
+        self._entries[key] = (expiry, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisCache:
+    """
+    RedisCache
+        cache stored on a Redis server (or anything speaking its
+        protocol), shared by all the workers. Keys are namespaced with
+        prefix and values pickled, behind an HMAC-SHA256 signature
+        made with secret: a value that is not signed with it is
+        never unpickled, it is dropped as a miss. Values can only be
+        stored and read with a secret, counters of incr() need none.
+        The connection is opened lazily and again after a fork or a
+        network error.
+    """
+
+    def __init__(self, host='localhost', port=6379, db=0, password=None,
+                 prefix='trivia:', timeout=1.0, secret=None):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.prefix = prefix
+        self.timeout = timeout
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        self._socket = None
+        self._reader = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        self._check_secret()
+        try:
+            value = self.execute('GET', self.prefix + key)
+        except (OSError, EOFError, RedisError) as error:
+            logger.warning('Cache get of %s failed: %s', key, error)
+            return None
+        return None if value is None else self._loads(key, value)
+
+    def set(self, key, value, ttl=None):
+        data = self._dumps(value)
+        try:
+            self.execute('SET', self.prefix + key, data, *self._expiry(ttl))
+        except (OSError, EOFError, RedisError) as error:
+            logger.warning('Cache set of %s failed: %s', key, error)
+
+    def add(self, key, value, ttl=None):
+        data = self._dumps(value)
+        try:
+            reply = self.execute('SET', self.prefix + key, data,
+                                 'NX', *self._expiry(ttl))
+        except (OSError, EOFError, RedisError) as error:
+            logger.warning('Cache add of %s failed: %s', key, error)
+            return False
+        return reply is not None
+
+    def incr(self, key, ttl=None):
+        value = self.execute('INCR', self.prefix + key)
+        # the first increment starts the expiry of the counter
+        if value == 1 and ttl:
+            self.execute('PEXPIRE', self.prefix + key, int(ttl * 1000))
+        return value
+
+    def delete(self, key):
+        try:
+            self.execute('DEL', self.prefix + key)
+        except (OSError, EOFError, RedisError) as error:
+            logger.warning('Cache delete of %s failed: %s', key, error)
+
+    def clear(self):
+        cursor = b'0'
+        while True:
+            cursor, keys = self.execute(
+                'SCAN', cursor, 'MATCH', self.prefix + '*', 'COUNT', 1000
+            )
+            if keys:
+                self.execute('DEL', *keys)
+            if cursor == b'0':
+                break
+
+    def execute(self, *args):
+        """
+        sends one command and returns its decoded reply
+        """
+        with self._lock:
+            try:
+                self._connect()
+                self._socket.sendall(_encode_command(args))
+                reply = self._read_reply()
+            except (OSError, EOFError):
+                self._close()
+                raise
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    def _check_secret(self):
+        if not self.secret:
+            raise ValueError('RedisCache needs a secret to store values.')
+
+    def _dumps(self, value):
+        self._check_secret()
+        data = pickle.dumps(value)
+        return hmac.new(self.secret, data, hashlib.sha256).digest() + data
+
+    def _loads(self, key, value):
+        signature, data = value[:32], value[32:]
+        expected = hmac.new(self.secret, data, hashlib.sha256).digest()
+        if not hmac.compare_digest(signature, expected):
+            logger.warning('Cache value of %s has a bad signature.', key)
+            return None
+        return pickle.loads(data)
+
+    def _expiry(self, ttl):
+        return ('PX', int(ttl * 1000)) if ttl else ()
+
+    def _connect(self):
+        if self._socket is not None and self._pid == os.getpid():
+            return
+        self._socket = socket.create_connection(
+            (self.host, self.port),
+            self.timeout
+        )
+        self._reader = self._socket.makefile('rb')
+        self._pid = os.getpid()
+        if self.password:
+            self._command('AUTH', self.password)
+        if self.db:
+            self._command('SELECT', self.db)
+
+    def _command(self, *args):
+        self._socket.sendall(_encode_command(args))
+        reply = self._read_reply()
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    def _close(self):
+        if self._socket is not None:
+            self._socket.close()
+        self._socket = None
+        self._reader = None
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise EOFError('Connection closed by the cache server.')
+        kind, data = line[:1], line[1:-2]
+        if kind == b'+':
+            return data.decode()
+        if kind == b'-':
+            return RedisError(data.decode())
+        if kind == b':':
+            return int(data)
+        if kind == b'$':
+            length = int(data)
+            if length < 0:
+                return None
+            value = self._reader.read(length + 2)
+            return value[:-2]
+        if kind == b'*':
+            length = int(data)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RedisError(f'Unexpected reply: {line!r}')
+
+
+def _encode_command(args):
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        elif isinstance(arg, int):
+            arg = str(arg).encode()
+        parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
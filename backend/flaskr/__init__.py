@@ -1,31 +1,135 @@
-from flask import Flask, request, abort, jsonify
-from flask_cors import CORS
-import random
-
-from models import setup_db, Question, Category
-
-QUESTIONS_PER_PAGE = 10
-
+import os
+import time
 
-def paginate_questions(request, list):
-    # get page
-    page = request.args.get('page', 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-
-    # format the list
-    formatted_list = [row.format() for row in list]
+from flask import Flask, Response, request, abort
+from flask import stream_with_context
+from flask_cors import CORS
 
-    # filter list
-    return formatted_list[start:end]
+from cache import RedisCache, create_cache
+from models import (
+    set_cache,
+    get_cache,
+    delete_questions,
+    Question,
+    Category
+)
+from .http_cache import cached_response
+from .serialization import jsonify
+from .pagination import paginate_category, category_counts
+from .quiz import (
+    QuizSessionStore,
+    pick_random_question,
+    pick_adaptive_question,
+    quiz_difficulty,
+    get_candidate_ids,
+    next_session_question
+)
+from .bulk import (
+    IMPORT_FORMATS,
+    IMPORT_BATCH_SIZE,
+    EXPORT_FORMATS,
+    EXPORT_MIMETYPES,
+    apply_question_batch,
+    import_questions,
+    export_questions,
+    read_rows,
+    register_bulk_commands
+)
+from .search import SEARCH_BACKENDS, paginate_search
+from .stats import question_stats
+from .metrics import init_metrics
+from .compression import init_compression
+from .admission import (
+    DEFAULT_ADMISSION_LIMITS,
+    init_admission_control,
+    retry_after_headers
+)
+from .schema import register_schema_commands
+from .startup import init_database, init_startup_timings
 
 
 def create_app(test_config=None):
     # create and configure the app
+    started = time.perf_counter()
     app = Flask(__name__)
+    app.extensions['startup_timings'] = {}
+    app.config.from_mapping(
+        SEARCH_BACKEND=os.environ.get('SEARCH_BACKEND', 'fulltext'),
+        CACHE_URL=os.environ.get('CACHE_URL', 'memory://'),
+        CACHE_SECRET=os.environ.get('CACHE_SECRET'),
+        CACHE_SIZE=int(os.environ.get('CACHE_SIZE', 1024)),
+        CACHE_TTL=int(os.environ.get('CACHE_TTL', 300)),
+        RESPONSE_CACHE=os.environ.get('RESPONSE_CACHE', '1') == '1',
+        RESPONSE_CACHE_MAX_AGE=int(
+            os.environ.get('RESPONSE_CACHE_MAX_AGE', 0)
+        ),
+        QUIZ_SESSION_TTL=int(os.environ.get('QUIZ_SESSION_TTL', 3600)),
+        QUIZ_SESSION_MAX=int(os.environ.get('QUIZ_SESSION_MAX', 10000)),
+        QUESTION_INDEX=os.environ.get('QUESTION_INDEX', '1') == '1',
+        FAST_JSON=os.environ.get('FAST_JSON', '1') == '1',
+        METRICS=os.environ.get('METRICS', '1') == '1',
+        SLOW_REQUEST_MS=float(os.environ.get('SLOW_REQUEST_MS', 1000)),
+        COMPRESSION=os.environ.get('COMPRESSION', '1') == '1',
+        COMPRESSION_MIN_SIZE=int(os.environ.get('COMPRESSION_MIN_SIZE', 500)),
+        ADMISSION_CONTROL=os.environ.get('ADMISSION_CONTROL', '1') == '1',
+        ADMISSION_LIMITS=os.environ.get(
+            'ADMISSION_LIMITS',
+            DEFAULT_ADMISSION_LIMITS
+        ),
+        ADMISSION_QUEUE_MS=float(os.environ.get('ADMISSION_QUEUE_MS', 100)),
+        RATE_LIMIT_URL=os.environ.get('RATE_LIMIT_URL', 'memory://'),
+        LAZY_INIT=os.environ.get('LAZY_INIT', '0') == '1',
+        WARM_CACHES=os.environ.get('WARM_CACHES')
+    )
+    if isinstance(test_config, dict):
+        app.config.from_mapping(test_config)
+
+    if app.config['SEARCH_BACKEND'] not in SEARCH_BACKENDS:
+        raise ValueError(
+            f'SEARCH_BACKEND must be one of {", ".join(SEARCH_BACKENDS)}.'
+        )
+
+    # cache backend shared by the category map, the responses and
+    # the quiz candidates, see cache.py
+    cache = create_cache(
+        app.config['CACHE_URL'],
+        app.config['CACHE_SIZE'],
+        app.config['CACHE_SECRET']
+    )
+    if isinstance(cache, RedisCache) and not app.config['CACHE_SECRET']:
+        # values read from a shared server are signed with it
+        raise ValueError('CACHE_SECRET must be set with a redis CACHE_URL.')
+    set_cache(cache)
+
     if test_config is None:
-        setup_db(app)
+        # bind the database and warm the caches, or defer both with
+        # LAZY_INIT, see init_database
+        init_database(app)
+
+    # cache of the GET responses, see cached_response
+    if app.config['RESPONSE_CACHE']:
+        app.extensions['response_cache'] = get_cache()
+    # server-side quiz sessions, see QuizSessionStore
+    quiz_sessions = QuizSessionStore(
+        app.config['QUIZ_SESSION_TTL'],
+        app.config['QUIZ_SESSION_MAX']
+    )
+    app.extensions['quiz_sessions'] = quiz_sessions
+
     CORS(app)
+    register_bulk_commands(app)
+    register_schema_commands(app)
+    # per-route latency, SQL and size metrics on GET /metrics
+    if app.config['METRICS']:
+        init_metrics(app)
+    # gzip/brotli, registered after the metrics so they see the
+    # compressed size
+    if app.config['COMPRESSION']:
+        init_compression(app)
+    # rate and concurrency limits of the searches and quizzes,
+    # registered after the metrics so rejected requests are counted
+    if app.config['ADMISSION_CONTROL']:
+        init_admission_control(app)
 
     # CORS configuration using after_request
     @app.after_request
@@ -47,9 +151,10 @@ def create_app(test_config=None):
     """
     # get the list of categories
     @app.route('/categories', methods=['GET'])
+    @cached_response
     def get_categories():
         try:
-            categories = Category.query.order_by(Category.id).all()
+            categories = Category.get_map()
 
             if len(categories) == 0:
                 # return 404
@@ -57,7 +162,7 @@ def create_app(test_config=None):
             else:
                 # return 200
                 results = {
-                    str(category.id): category.type for category in categories
+                    str(key): value for key, value in categories.items()
                 }
                 return jsonify({
                     'categories': results
@@ -80,40 +185,90 @@ def create_app(test_config=None):
     """
     # get the list of questions, paginated
     @app.route('/questions', methods=['GET'])
+    @cached_response
     def get_questions():
         try:
             # get categories list
-            categories = Category.query.order_by(Category.id).all()
+            categories = Category.get_map()
             if len(categories) == 0:
                 abort(404)
             else:
                 # take the first category as current
-                current_category = categories[0].type
-
-                # get questions
-                list = Question.query.order_by(Question.id).all()
+                current_category = next(iter(categories.values()))
 
-                # paginate questions
-                current_questions = paginate_questions(request, list)
+                # get and paginate questions
+                page = paginate_category(request, 0)
 
-                if len(current_questions) == 0:
+                if len(page['questions']) == 0:
                     # return 404
                     abort(404)
                 else:
                     # return 200
                     return jsonify({
-                        'questions': current_questions,
+                        **page,
                         'categories': {
-                            str(row.id): row.type for row in categories
+                            str(key): value
+                            for key, value in categories.items()
                         },
-                        'currentCategory': current_category,
-                        'totalQuestions': len(list)
+                        'currentCategory': current_category
                     })
         except Exception as error:
             # internal server error
             print(f'GET /questions error: {error}')
             abort(500)
 
+    """
+    Everything the list view needs on first load in one response:
+    the categories, the first page of questions, the number of
+    questions of every category and the total.
+    """
+    # get the initial state of the frontend
+    @app.route('/bootstrap', methods=['GET'])
+    @cached_response
+    def get_bootstrap():
+        try:
+            # get categories list
+            categories = Category.get_map()
+            if len(categories) == 0:
+                abort(404)
+
+            # get the requested page (the first one by default)
+            page = paginate_category(request, 0)
+
+            # count the questions of every category at once
+            counts = category_counts()
+
+            # return 200, an empty question bank is not an error here
+            return jsonify({
+                **page,
+                'categories': {
+                    str(key): value for key, value in categories.items()
+                },
+                'categoryCounts': {
+                    str(key): counts.get(key, 0) for key in categories
+                },
+                'currentCategory': next(iter(categories.values()))
+            })
+        except Exception as error:
+            # internal server error
+            print(f'GET /bootstrap error: {error}')
+            abort(500)
+
+    """
+    Number of questions by category and by difficulty, for the
+    dashboards.
+    """
+    # get the question statistics
+    @app.route('/stats', methods=['GET'])
+    @cached_response
+    def get_stats():
+        try:
+            return jsonify(question_stats())
+        except Exception as error:
+            # internal server error
+            print(f'GET /stats error: {error}')
+            abort(500)
+
     """
     Create a GET endpoint to get questions based on category.
     TEST: In the "List" tab / main screen, clicking on one of the
@@ -122,41 +277,56 @@ def create_app(test_config=None):
     """
     # get the list of questions by category
     @app.route('/categories/<int:category_id>/questions', methods=['GET'])
+    @cached_response
     def get_questions_by_category(category_id):
         try:
             # get the category
-            category = Category.query.filter(
-                Category.id == category_id).one_or_none()
+            category_type = Category.get_map().get(category_id)
 
-            if category is None:
+            if category_type is None:
                 abort(404, 'Category not found.')
 
-            # get the questions
-            base_query = Question.query.filter(
-                Question.category == category_id
-            )
-
-            # get questions from db
-            list = base_query.all()
+            # get and paginate the questions
+            page = paginate_category(request, category_id)
 
-            # paginate questions
-            current_questions = paginate_questions(request, list)
-
-            if len(current_questions) == 0:
+            if len(page['questions']) == 0:
                 # return 404
                 abort(404)
             else:
                 # return 200
                 return jsonify({
-                    'questions': current_questions,
-                    'totalQuestions': len(list),
-                    "currentCategory": category.type
+                    **page,
+                    "currentCategory": category_type
                 })
         except Exception as error:
             # internal server error
             print(f'GET /categories/<id>/questions error: {error}')
             abort(500)
 
+    """
+    Streaming export of the questions as JSON lines or CSV,
+    optionally filtered by category and difficulty.
+    """
+    @app.route('/questions/export', methods=['GET'])
+    def export_questions_stream():
+        # get format and filters
+        format = request.args.get('format', 'jsonl')
+        if format not in EXPORT_FORMATS:
+            abort(400, f'Format must be one of {", ".join(EXPORT_FORMATS)}.')
+        category = request.args.get('category', None, type=int)
+        difficulty = request.args.get('difficulty', None, type=int)
+
+        # stream the rows while they are read
+        lines = export_questions(format, category, difficulty)
+        response = Response(
+            stream_with_context(lines),
+            mimetype=EXPORT_MIMETYPES[format]
+        )
+        response.headers['Content-Disposition'] = (
+            f'attachment; filename=questions.{format}'
+        )
+        return response
+
     """
     Create an endpoint to DELETE question using a question ID.
     TEST: When you click the trash icon next to a question,
@@ -168,22 +338,17 @@ def create_app(test_config=None):
     @app.route('/questions/<int:question_id>', methods=['DELETE'])
     def delete_question_by_id(question_id):
         try:
-            # get the question by id
-            question = Question.query.filter(
-                Question.id == question_id
-            ).one_or_none()
+            # delete the question by id, without loading it
+            deleted = delete_questions([question_id])
 
             # returns formatted result
-            if question is None:
+            if not deleted:
                 # not found
                 abort(404)
             else:
-                # delete question
-                question.delete()
-
                 # success
                 return jsonify({
-                    'deleted': question.id
+                    'deleted': deleted[0]
                 })
         except Exception as error:
             # internal server error
@@ -221,26 +386,25 @@ def create_app(test_config=None):
         new_category = body.get('category', None)
         new_difficulty = body.get('difficulty', 1)
         search = body.get('searchTerm', None)
+        search_answers = body.get('searchAnswers', False)
 
         if search is not None:
             try:
-                # search questions
-                list = Question.query.filter(
-                    Question.question.ilike(f'%{search}%')
-                ).order_by(
-                    Question.id
-                ).all()
-
-                # paginate questions
-                current_questions = paginate_questions(request, list)
+                # search and paginate questions
+                page = paginate_search(
+                    request,
+                    search,
+                    search_answers=search_answers
+                )
 
-                category = Category.query.order_by(Category.id).first()
+                # take the first category as current
+                categories = Category.get_map()
+                current_category = next(iter(categories.values()))
 
                 # return found results
                 return jsonify({
-                    'questions': current_questions,
-                    'totalQuestions': len(list),
-                    'currentCategory': category.type
+                    **page,
+                    'currentCategory': current_category
                 }), 200
             except Exception as error:
                 # internal server error
@@ -248,17 +412,26 @@ def create_app(test_config=None):
                 abort(500)
         elif new_question is not None and new_answer is not None:
             # get category id
-            category = Category.query.filter_by(id=new_category).one_or_none()
+            try:
+                category_id = int(new_category)
+            except (TypeError, ValueError):
+                category_id = None
 
-            if category is None:
+            if category_id not in Category.get_map():
                 abort(400, 'Category is not correct.')
 
+            # get difficulty, posted as a string by the form
+            try:
+                difficulty = int(new_difficulty)
+            except (TypeError, ValueError):
+                abort(400, 'Difficulty is not correct.')
+
             # create question
             question = Question(
                 question=new_question,
                 answer=new_answer,
-                category=category.id,
-                difficulty=new_difficulty
+                category=category_id,
+                difficulty=difficulty
             )
             question.insert()
 
@@ -269,6 +442,70 @@ def create_app(test_config=None):
         else:
             abort(422)
 
+    """
+    Bulk import of questions from a JSON lines or CSV body.
+    Invalid rows are reported and skipped, the others are
+    written in batches.
+    """
+    @app.route('/questions/bulk', methods=['POST'])
+    def bulk_import_questions():
+        # get format and batch size
+        format = request.args.get('format')
+        if format is None:
+            format = 'csv' if request.mimetype == 'text/csv' else 'jsonl'
+        if format not in IMPORT_FORMATS:
+            abort(400, f'Format must be one of {", ".join(IMPORT_FORMATS)}.')
+        batch_size = request.args.get(
+            'batch_size',
+            IMPORT_BATCH_SIZE,
+            type=int
+        )
+        if batch_size < 1:
+            abort(400, '"batch_size" must be positive.')
+
+        try:
+            # read the body line by line
+            lines = (line.decode('utf-8') for line in request.stream)
+            report = import_questions(read_rows(lines, format), batch_size)
+        except Exception as error:
+            # internal server error
+            print(f'POST /questions/bulk error: {error}')
+            abort(500)
+
+        # the rows before the invalid text are imported all the same
+        aborted = report.pop('aborted', None)
+        if aborted is not None:
+            return jsonify({
+                'success': False,
+                'error': 400,
+                'message': f'Bad request {aborted}',
+                **report
+            }), 400
+
+        return jsonify(report), 200
+
+    """
+    Batch of question inserts and deletes in one transaction,
+    with one result per operation.
+    """
+    @app.route('/questions/batch', methods=['POST'])
+    def batch_questions():
+        # get body
+        body = request.get_json()
+        if body is None:
+            abort(400, 'Body is empty.')
+
+        try:
+            results = apply_question_batch(body.get('operations'))
+        except ValueError as error:
+            abort(400, str(error))
+
+        return jsonify({
+            'results': results,
+            'inserted': sum(result['op'] == 'insert' for result in results),
+            'deleted': sum(bool(result.get('deleted')) for result in results)
+        }), 200
+
     """
     Create a POST endpoint to get questions to play the quiz.
     This endpoint should take category and previous question parameters
@@ -292,43 +529,109 @@ def create_app(test_config=None):
                 'Both "quiz_category" and "previous_questions" are required.'
             )
 
+        # optional target difficulty, and number of questions played
+        # before it goes up by one
+        difficulty = body.get('difficulty', None)
+        ramp = body.get('ramp', None)
+        for name, value in (('difficulty', difficulty), ('ramp', ramp)):
+            if value is not None and (
+                not isinstance(value, int) or isinstance(value, bool)
+                or value < 1
+            ):
+                abort(400, f'"{name}" must be a positive integer.')
+
         try:
             # get category id
-            category_id = quiz_category.get('id')
-
-            # base query
-            base_query = Question.query
-
-            # filter by category
-            if category_id != 0:
-                base_query = base_query.filter_by(category=category_id)
-
-            # get questions from db
-            questions = base_query.all()
-
-            # filter out previous questions
-            if previous_questions is not None:
-                questions = [
-                    q for q in questions if q.id not in previous_questions]
+            category_id = int(quiz_category.get('id'))
+
+            # select a random question not played yet, of the target
+            # difficulty if any
+            if difficulty is None and ramp is None:
+                random_question = pick_random_question(
+                    category_id,
+                    previous_questions
+                )
+            else:
+                random_question = pick_adaptive_question(
+                    category_id,
+                    previous_questions,
+                    quiz_difficulty(
+                        difficulty,
+                        ramp,
+                        len(previous_questions)
+                    )
+                )
 
             # if no available questions return empty response
-            if not questions:
+            if random_question is None:
                 return jsonify({
                     'question': None
                 }), 200
             else:
-                # select a random question
-                random_question = random.choice(questions)
-
                 # return random question
                 return jsonify({
-                    'question': random_question.format()
+                    'question': random_question
                 }), 200
         except Exception as error:
             # internal server error
             print(f'POST /quizzes error: {error}')
             abort(500)
 
+    """
+    Quiz sessions: the server keeps the shuffled questions of the
+    quiz, so the client does not send previous_questions.
+    POST /quizzes/sessions creates a session for a quiz_category,
+    POST /quizzes/sessions/<id>/next returns its next question.
+    """
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def create_quiz_session():
+        # get body parameters
+        body = request.get_json()
+        if body is None or body.get('quiz_category') is None:
+            abort(400, '"quiz_category" is required.')
+
+        try:
+            # get category id
+            category_id = int(body['quiz_category'].get('id'))
+
+            # shuffle the questions of the category
+            ids = get_candidate_ids(category_id)
+            session_id = quiz_sessions.create(ids)
+
+            # created
+            return jsonify({
+                'session_id': session_id,
+                'totalQuestions': len(ids)
+            }), 201
+        except Exception as error:
+            # internal server error
+            print(f'POST /quizzes/sessions error: {error}')
+            abort(500)
+
+    @app.route('/quizzes/sessions/<session_id>/next', methods=['POST'])
+    def next_quiz_question(session_id):
+        try:
+            question, remaining = next_session_question(
+                quiz_sessions,
+                session_id
+            )
+        except KeyError:
+            abort(404, 'Quiz session not found.')
+
+        return jsonify({
+            'question': question,
+            'remaining': remaining
+        }), 200
+
+    @app.route('/quizzes/sessions/<session_id>', methods=['DELETE'])
+    def delete_quiz_session(session_id):
+        if not quiz_sessions.delete(session_id):
+            abort(404, 'Quiz session not found.')
+
+        return jsonify({
+            'deleted': session_id
+        })
+
     """
     Create error handlers for all expected errors
     including 404 and 422.
@@ -365,6 +668,22 @@ def create_app(test_config=None):
             "message": f"Unprocessable. {error}"
         }), 500
 
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        return jsonify({
+            "success": False,
+            "error": 429,
+            "message": f"Too many requests. {error}"
+        }), 429, retry_after_headers(error)
+
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        return jsonify({
+            "success": False,
+            "error": 503,
+            "message": f"Service unavailable. {error}"
+        }), 503, retry_after_headers(error)
+
     @app.errorhandler(500)
     def internal_error(error):
         return jsonify({
@@ -373,4 +692,7 @@ def create_app(test_config=None):
             "message": f"Internal server error. {error}"
         }), 500
 
+    # logs the startup phases, times the first response
+    init_startup_timings(app, started)
+
     return app
@@ -0,0 +1,239 @@
+import math
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from urllib.parse import urlparse
+
+from flask import g, request
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+from cache import RedisError, create_cache
+
+# route class -> limits, as ADMISSION_LIMITS
+DEFAULT_ADMISSION_LIMITS = 'search=5:20:4,quiz=20:50:16'
+
+# endpoints of the quiz route class
+QUIZ_ENDPOINTS = (
+    'play_quiz',
+    'create_quiz_session',
+    'next_quiz_question'
+)
+
+# requests per second and burst of each client, concurrent requests
+# of the process; 0 disables a limit
+AdmissionLimit = namedtuple('AdmissionLimit', ('rate', 'burst', 'concurrency'))
+
+
+def parse_limits(value):
+    """
+    parse_limits(value)
+        returns {route class: AdmissionLimit} from a string of
+        class=rate:burst:concurrency entries separated by commas,
+        raises ValueError when it is malformed
+    """
+    limits = {}
+    for entry in value.split(','):
+        if not entry.strip():
+            continue
+        name, _, numbers = entry.partition('=')
+        name = name.strip()
+        if name not in ('search', 'quiz'):
+            raise ValueError(f'Unknown admission route class: {name}')
+        try:
+            rate, burst, concurrency = numbers.split(':')
+            limit = AdmissionLimit(float(rate), int(burst), int(concurrency))
+        except ValueError:
+            raise ValueError(
+                f'Admission limits of {name} must be rate:burst:concurrency.'
+            )
+        if limit.rate < 0 or limit.burst < 0 or limit.concurrency < 0:
+            raise ValueError(f'Admission limits of {name} must be positive.')
+        limits[name] = limit
+    return limits
+
+
+def route_class(request):
+    """
+    route_class(request)
+        returns the route class of the request, 'search' for the
+        search request of POST /questions, 'quiz' for the quiz
+        routes, None for the routes that are not limited
+    """
+    if request.endpoint in QUIZ_ENDPOINTS:
+        return 'quiz'
+    if request.endpoint == 'create_or_search_question':
+        body = request.get_json(silent=True)
+        if isinstance(body, dict) and body.get('searchTerm') is not None:
+            return 'search'
+    return None
+
+
+class TokenBuckets:
+    """
+    In-process token buckets, one per key: a bucket holds up to
+    burst tokens, refilled at rate tokens per second, and every
+    request takes one. The least recently used buckets are dropped
+    beyond max_keys, a dropped bucket starts full again.
+    """
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> (tokens, time of the last refill)
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """
+        takes a token of the bucket of key, returns 0 when there was
+        one, else the seconds until the next one
+        """
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class CacheRateLimiter:
+    """
+    Rate limiter shared by the workers through a cache backend:
+    requests of a key are counted with cache.incr() in fixed windows
+    of burst / rate seconds, burst of them allowed per window.
+    When the backend is unreachable requests are let through.
+    """
+
+    def __init__(self, cache, rate, burst, prefix='ratelimit'):
+        self.cache = cache
+        self.burst = burst
+        self.window = burst / rate
+        self.prefix = prefix
+
+    def take(self, key):
+        now = time.time()
+        number = int(now // self.window)
+        try:
+            count = self.cache.incr(
+                f'{self.prefix}:{key}:{number}',
+                self.window
+            )
+        except (OSError, EOFError, RedisError):
+            return 0
+        if count <= self.burst:
+            return 0
+        return (number + 1) * self.window - now
+
+
+class AdmissionController:
+    """
+    Admission control of the limited route classes: each client
+    (by IP address) is rate limited per class, and at most
+    concurrency requests of a class run at once in the process, a
+    request waiting up to queue_timeout seconds for a slot.
+    Rate limits are kept in process with the memory:// url, or in
+    the cache backend of any other url of cache.create_cache so
+    every worker shares them.
+    """
+
+    def __init__(self, limits, url='memory://', queue_timeout=0.1):
+        self.limits = limits
+        self.queue_timeout = queue_timeout
+        shared = None
+        if urlparse(url).scheme != 'memory':
+            shared = create_cache(url)
+
+        self._limiters = {}
+        self._slots = {}
+        for name, limit in limits.items():
+            if limit.rate > 0 and limit.burst > 0:
+                self._limiters[name] = (
+                    TokenBuckets(limit.rate, limit.burst)
+                    if shared is None
+                    else CacheRateLimiter(
+                        shared,
+                        limit.rate,
+                        limit.burst,
+                        prefix=f'ratelimit:{name}'
+                    )
+                )
+            if limit.concurrency > 0:
+                self._slots[name] = threading.BoundedSemaphore(
+                    limit.concurrency
+                )
+
+    def admit(self, name, client):
+        """
+        admits a request of the route class name, raises
+        TooManyRequests when the client is over its rate and
+        ServiceUnavailable when every slot stays busy, both with a
+        retry_after in seconds.
+        Returns the slot to release at the end of the request, or
+        None.
+        """
+        limiter = self._limiters.get(name)
+        if limiter is not None:
+            wait = limiter.take(client)
+            if wait > 0:
+                raise TooManyRequests(
+                    f'Rate limit of {name} requests exceeded.',
+                    retry_after=math.ceil(wait)
+                )
+
+        slots = self._slots.get(name)
+        if slots is not None:
+            if not slots.acquire(timeout=self.queue_timeout):
+                raise ServiceUnavailable(
+                    f'Too many {name} requests in progress.',
+                    retry_after=1
+                )
+        return slots
+
+
+def retry_after_headers(error):
+    """
+    retry_after_headers(error)
+        returns the Retry-After header of a 429 or 503 error, to add
+        to its JSON response
+    """
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is None:
+        return {}
+    return {'Retry-After': str(retry_after)}
+
+
+def init_admission_control(app):
+    """
+    init_admission_control(app)
+        limits the search and quiz requests of the app with an
+        AdmissionController configured by ADMISSION_LIMITS,
+        RATE_LIMIT_URL and ADMISSION_QUEUE_MS. Requests over a limit
+        are answered at once with a 429 or a 503 and Retry-After,
+        before reaching the database.
+    """
+    controller = AdmissionController(
+        parse_limits(app.config['ADMISSION_LIMITS']),
+        app.config['RATE_LIMIT_URL'],
+        app.config['ADMISSION_QUEUE_MS'] / 1000
+    )
+    app.extensions['admission'] = controller
+
+    @app.before_request
+    def admit_request():
+        name = route_class(request)
+        if name is not None:
+            g.admission_slot = controller.admit(name, request.remote_addr)
+
+    @app.teardown_request
+    def release_request(error=None):
+        slot = g.pop('admission_slot', None)
+        if slot is not None:
+            slot.release()
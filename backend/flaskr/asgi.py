@@ -0,0 +1,748 @@
+import asyncio
+import json
+import os
+import random
+import re
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import (
+    HTTPException,
+    InternalServerError,
+    MethodNotAllowed,
+    NotFound,
+    abort
+)
+
+from cache import LRUCache
+from models import (
+    database_path,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_RECYCLE,
+    DB_STATEMENT_TIMEOUT,
+    CATEGORY_CACHE_TTL,
+    QUESTION_FIELDS,
+    format_question_row
+)
+from .pagination import (
+    question_fields,
+    _per_page,
+    _page_start,
+    _cursor_args
+)
+from .quiz import QuizSessionStore, nearest_difficulties, quiz_difficulty
+from .serialization import dumps
+
+try:
+    import asyncpg
+except ImportError:  # optional, only needed to serve PostgreSQL
+    asyncpg = None
+
+try:
+    import aiosqlite
+except ImportError:  # optional, only needed to serve SQLite
+    aiosqlite = None
+
+# status, "error" and message of the error bodies, the same as the
+# error handlers of create_app
+ERROR_RESPONSES = {
+    400: (400, 'Bad request {}'),
+    404: (404, 'Not found. {}'),
+    405: (405, 'Method not allowed. {}'),
+    422: (500, 'Unprocessable. {}'),
+    500: (500, 'Internal server error. {}')
+}
+
+CORS_HEADERS = (
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Content-Type,Authorization'),
+    (b'access-control-allow-methods', b'GET,POST,PUT,DELETE')
+)
+
+QUESTION_SELECT = f'SELECT {", ".join(QUESTION_FIELDS)} FROM questions'
+
+
+def create_asgi_app(database_url=database_path, test_config=None):
+    """
+    create_asgi_app(database_url, test_config)
+        returns the ASGI application of the async serving mode,
+        configured from the environment like create_app and
+        optionally overridden by the test_config dict
+    """
+    config = {
+        'QUIZ_SESSION_TTL': int(os.environ.get('QUIZ_SESSION_TTL', 3600)),
+        'QUIZ_SESSION_MAX': int(os.environ.get('QUIZ_SESSION_MAX', 10000)),
+        'FAST_JSON': os.environ.get('FAST_JSON', '1') == '1'
+    }
+    if isinstance(test_config, dict):
+        config.update(test_config)
+
+    return AsyncTriviaApp(AsyncDatabase(database_url), config)
+
+
+class AsyncDatabase:
+    """
+    Connection pool of an async driver: asyncpg for postgresql://
+    urls, aiosqlite for sqlite:// ones (a local stand-in using a
+    single connection). Statements take $1, $2... parameters in
+    order on both. The pool is opened on first use.
+    """
+
+    def __init__(self, url, min_size=1,
+                 max_size=DB_POOL_SIZE + DB_MAX_OVERFLOW):
+        scheme, rest = url.split(':', 1)
+        # drop the SQLAlchemy driver name, postgresql+psycopg2://
+        self.dialect = scheme.split('+')[0]
+        self.url = f'{self.dialect}:{rest}'
+        self.min_size = min_size
+        self.max_size = max_size
+        self._pool = None
+        self._lock = None
+
+    async def connect(self):
+        if self._pool is not None:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._pool is None:
+                self._pool = await self._create_pool()
+
+    async def close(self):
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await pool.close()
+
+    async def fetch(self, sql, *args):
+        """
+        returns the rows of a statement as sequences of the values
+        """
+        await self.connect()
+        return await self._pool.fetch(sql, *args)
+
+    async def fetchrow(self, sql, *args):
+        rows = await self.fetch(sql, *args)
+        return rows[0] if rows else None
+
+    async def fetchval(self, sql, *args):
+        row = await self.fetchrow(sql, *args)
+        return None if row is None else row[0]
+
+    def exclude_ids(self, column, ids, args):
+        """
+        returns the condition "column not in ids", appending its
+        parameters to args
+        """
+        if self.dialect == 'postgresql':
+            args.append(list(ids))
+            return f'NOT ({column} = ANY(${len(args)}::int[]))'
+
+        placeholders = []
+        for id in ids:
+            args.append(id)
+            placeholders.append(f'${len(args)}')
+        return f'{column} NOT IN ({", ".join(placeholders)})'
+
+    async def _create_pool(self):
+        if self.dialect == 'postgresql':
+            if asyncpg is None:
+                raise RuntimeError('asyncpg is required to serve PostgreSQL.')
+            settings = {}
+            if DB_STATEMENT_TIMEOUT:
+                settings['statement_timeout'] = str(DB_STATEMENT_TIMEOUT)
+            return await asyncpg.create_pool(
+                self.url,
+                min_size=self.min_size,
+                max_size=self.max_size,
+                max_inactive_connection_lifetime=DB_POOL_RECYCLE,
+                server_settings=settings
+            )
+
+        if self.dialect == 'sqlite':
+            if aiosqlite is None:
+                raise RuntimeError('aiosqlite is required to serve SQLite.')
+            # sqlite:///relative.db, sqlite:////absolute.db, sqlite://
+            path = self.url[len('sqlite:///'):] or ':memory:'
+            return SQLitePool(await aiosqlite.connect(path))
+
+        raise ValueError(f'Unsupported database url: {self.url}')
+
+
+class SQLitePool:
+    """
+    the fetch()/close() interface of an asyncpg pool over a single
+    aiosqlite connection
+    """
+
+    PARAMETER = re.compile(r'\$\d+')
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    async def fetch(self, sql, *args):
+        sql = self.PARAMETER.sub('?', sql)
+        async with self.connection.execute(sql, args) as cursor:
+            return await cursor.fetchall()
+
+    async def close(self):
+        await self.connection.close()
+
+
+class AsyncRequest:
+    """
+    the parts of an ASGI http request used by the routes, args being
+    a MultiDict like flask.request.args
+    """
+
+    def __init__(self, method, path, args, headers, body):
+        self.method = method
+        self.path = path
+        self.args = args
+        self.headers = headers
+        self.body = body
+
+    @classmethod
+    async def read(cls, scope, receive):
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        return cls(
+            scope['method'],
+            scope['path'],
+            MultiDict(parse_qsl(scope['query_string'].decode('latin-1'))),
+            {
+                name.decode('latin-1').lower(): value.decode('latin-1')
+                for name, value in scope['headers']
+            },
+            body
+        )
+
+    def get_json(self):
+        """
+        returns the decoded JSON body, None when it is not JSON,
+        like flask.request.get_json()
+        """
+        mimetype = self.headers.get('content-type', '').split(';')[0]
+        mimetype = mimetype.strip().lower()
+        if mimetype != 'application/json' and not (
+            mimetype.startswith('application/')
+            and mimetype.endswith('+json')
+        ):
+            return None
+
+        try:
+            return json.loads(self.body)
+        except ValueError as error:
+            abort(400, f'Failed to decode JSON object: {error}')
+
+
+class AsyncTriviaApp:
+    """
+    ASGI application serving the category listings and the quizzes
+    of create_app (GET /categories, GET /questions, GET /bootstrap,
+    GET /categories/<id>/questions, POST /quizzes and the quiz
+    sessions) with the same JSON bodies and error responses.
+    Every database round-trip awaits a connection of the async pool
+    instead of blocking a worker, so one process can serve many
+    concurrent clients.
+    Writes, searches and bulk routes stay on the WSGI app.
+    """
+
+    def __init__(self, database, config):
+        self.database = database
+        self.config = config
+        # the category map, reloaded after CATEGORY_CACHE_TTL seconds
+        self.categories = LRUCache(1)
+        self.quiz_sessions = QuizSessionStore(
+            config['QUIZ_SESSION_TTL'],
+            config['QUIZ_SESSION_MAX']
+        )
+        # path pattern, methods, route
+        self.routes = [
+            (re.compile(r'/categories'), ('GET',), self.get_categories),
+            (re.compile(r'/questions'), ('GET',), self.get_questions),
+            (re.compile(r'/bootstrap'), ('GET',), self.get_bootstrap),
+            (
+                re.compile(r'/categories/(?P<category_id>\d+)/questions'),
+                ('GET',),
+                self.get_questions_by_category
+            ),
+            (re.compile(r'/quizzes'), ('POST',), self.play_quiz),
+            (
+                re.compile(r'/quizzes/sessions'),
+                ('POST',),
+                self.create_quiz_session
+            ),
+            (
+                re.compile(r'/quizzes/sessions/(?P<session_id>[^/]+)/next'),
+                ('POST',),
+                self.next_quiz_question
+            ),
+            (
+                re.compile(r'/quizzes/sessions/(?P<session_id>[^/]+)'),
+                ('DELETE',),
+                self.delete_quiz_session
+            )
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        request = await AsyncRequest.read(scope, receive)
+        status, body = await self.dispatch(request)
+
+        headers = list(CORS_HEADERS)
+        if body:
+            headers.append((b'content-type', b'application/json'))
+        headers.append((b'content-length', str(len(body)).encode()))
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': headers
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def lifespan(self, receive, send):
+        # open the pool at startup and close it at shutdown
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.database.connect()
+                except Exception as error:
+                    await send({
+                        'type': 'lifespan.startup.failed',
+                        'message': str(error)
+                    })
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.database.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def dispatch(self, request):
+        """
+        returns (status, body) of the response to the request
+        """
+        try:
+            if request.method == 'OPTIONS':
+                # CORS preflight
+                return 200, b''
+            route, arguments = self.match(request)
+            result = await route(request, **arguments)
+        except HTTPException as error:
+            result = self.handle_error(error)
+        except Exception as error:
+            # internal server error
+            print(f'{request.method} {request.path} error: {error}')
+            result = self.handle_error(
+                InternalServerError(original_exception=error)
+            )
+
+        data, status = result if isinstance(result, tuple) else (result, 200)
+        return status, dumps(data, self.config['FAST_JSON'])
+
+    def match(self, request):
+        allowed = []
+        for pattern, methods, route in self.routes:
+            match = pattern.fullmatch(request.path)
+            if match is None:
+                continue
+            if request.method not in methods:
+                allowed.extend(methods)
+                continue
+            arguments = match.groupdict()
+            if 'category_id' in arguments:
+                arguments['category_id'] = int(arguments['category_id'])
+            return route, arguments
+
+        if allowed:
+            raise MethodNotAllowed(allowed)
+        raise NotFound()
+
+    def handle_error(self, error):
+        status, message = ERROR_RESPONSES.get(
+            error.code,
+            (error.code, '{}')
+        )
+        return {
+            'success': False,
+            'error': status,
+            'message': message.format(error)
+        }, status
+
+    async def get_category_map(self):
+        """
+        returns the {id: type} map of all categories ordered by id
+        """
+        mapping = self.categories.get('categories')
+        if mapping is None:
+            rows = await self.database.fetch(
+                'SELECT id, type FROM categories ORDER BY id'
+            )
+            mapping = {id: type for id, type in rows}
+            self.categories.set('categories', mapping, CATEGORY_CACHE_TTL)
+        return mapping
+
+    async def paginate_category(self, request, category_id):
+        """
+        same as flaskr.pagination.paginate_category, reading the page
+        and the total with the async driver
+        """
+        fields = question_fields(request)
+        select = f'SELECT {", ".join(fields)} FROM questions'
+        args = []
+        conditions = []
+        if category_id != 0:
+            args.append(category_id)
+            conditions.append(f'category = ${len(args)}')
+
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+        total = await self.database.fetchval(
+            f'SELECT COUNT(*) FROM questions{where}',
+            *args
+        )
+
+        if 'after_id' in request.args:
+            # seek on the primary key, one extra row tells if there is
+            # more
+            after_id, limit = _cursor_args(request)
+            args.extend((after_id, limit + 1))
+            conditions.append(f'id > ${len(args) - 1}')
+            rows = await self.database.fetch(
+                f'{select} WHERE {" AND ".join(conditions)} '
+                f'ORDER BY id LIMIT ${len(args)}',
+                *args
+            )
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            return {
+                'questions': [
+                    format_question_row(row, fields) for row in rows
+                ],
+                'totalQuestions': total,
+                'next_cursor': rows[-1][0] if has_more else None
+            }
+
+        # pages before the first one are always empty
+        start = _page_start(request)
+        if start < 0:
+            return {'questions': [], 'totalQuestions': total}
+
+        args.extend((_per_page(request), start))
+        rows = await self.database.fetch(
+            f'{select}{where} ORDER BY id '
+            f'LIMIT ${len(args) - 1} OFFSET ${len(args)}',
+            *args
+        )
+        return {
+            'questions': [format_question_row(row, fields) for row in rows],
+            'totalQuestions': total
+        }
+
+    async def category_counts(self):
+        """
+        same as flaskr.pagination.category_counts, one GROUP BY query
+        """
+        rows = await self.database.fetch(
+            'SELECT category, COUNT(*) FROM questions '
+            'WHERE category IS NOT NULL GROUP BY category'
+        )
+        return {category: count for category, count in rows}
+
+    async def load_question(self, id):
+        row = await self.database.fetchrow(
+            f'{QUESTION_SELECT} WHERE id = $1',
+            id
+        )
+        return None if row is None else format_question_row(row)
+
+    async def pick_random_question(self, category_id, previous_questions,
+                                   difficulty=None):
+        """
+        same as flaskr.quiz.pick_in_database: one COUNT of the
+        questions not played yet and one row fetched at a random
+        offset.
+        With a target difficulty, the questions left are first
+        counted by difficulty to pick from the nearest one.
+        """
+        args = []
+        conditions = []
+        if category_id != 0:
+            args.append(category_id)
+            conditions.append(f'category = ${len(args)}')
+        if previous_questions:
+            conditions.append(self.database.exclude_ids(
+                'id',
+                [int(id) for id in previous_questions],
+                args
+            ))
+
+        # filter by the nearest difficulty having questions left
+        if difficulty is not None:
+            where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+            counts = await self.database.fetch(
+                f'SELECT difficulty, COUNT(*) FROM questions{where} '
+                f'GROUP BY difficulty',
+                *args
+            )
+            buckets = nearest_difficulties(
+                difficulty,
+                [bucket for bucket, count in counts if bucket is not None]
+            )
+            if not buckets:
+                return None
+            args.append(buckets[0])
+            conditions.append(f'difficulty = ${len(args)}')
+
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+
+        # a concurrent delete can shrink the candidates between the two
+        # statements, in that case try again with the new count
+        for _ in range(3):
+            count = await self.database.fetchval(
+                f'SELECT COUNT(*) FROM questions{where}',
+                *args
+            )
+            if count == 0:
+                return None
+
+            row = await self.database.fetchrow(
+                f'{QUESTION_SELECT}{where} ORDER BY id '
+                f'LIMIT 1 OFFSET ${len(args) + 1}',
+                *args,
+                random.randrange(count)
+            )
+            if row is not None:
+                return format_question_row(row)
+
+        return None
+
+    # routes, each one mirrors the route of create_app with its name
+
+    async def get_categories(self, request):
+        try:
+            categories = await self.get_category_map()
+
+            if len(categories) == 0:
+                # return 404
+                abort(404)
+            else:
+                # return 200
+                return {
+                    'categories': {
+                        str(key): value for key, value in categories.items()
+                    }
+                }
+        except Exception as error:
+            # internal server error
+            print(f'GET /categories error: {error}')
+            abort(500)
+
+    async def get_questions(self, request):
+        try:
+            # get categories list
+            categories = await self.get_category_map()
+            if len(categories) == 0:
+                abort(404)
+            else:
+                # take the first category as current
+                current_category = next(iter(categories.values()))
+
+                # get and paginate questions
+                page = await self.paginate_category(request, 0)
+
+                if len(page['questions']) == 0:
+                    # return 404
+                    abort(404)
+                else:
+                    # return 200
+                    return {
+                        **page,
+                        'categories': {
+                            str(key): value
+                            for key, value in categories.items()
+                        },
+                        'currentCategory': current_category
+                    }
+        except Exception as error:
+            # internal server error
+            print(f'GET /questions error: {error}')
+            abort(500)
+
+    async def get_bootstrap(self, request):
+        try:
+            # get categories list
+            categories = await self.get_category_map()
+            if len(categories) == 0:
+                abort(404)
+
+            # get the requested page (the first one by default)
+            page = await self.paginate_category(request, 0)
+
+            # count the questions of every category at once
+            counts = await self.category_counts()
+
+            # return 200, an empty question bank is not an error here
+            return {
+                **page,
+                'categories': {
+                    str(key): value for key, value in categories.items()
+                },
+                'categoryCounts': {
+                    str(key): counts.get(key, 0) for key in categories
+                },
+                'currentCategory': next(iter(categories.values()))
+            }
+        except Exception as error:
+            # internal server error
+            print(f'GET /bootstrap error: {error}')
+            abort(500)
+
+    async def get_questions_by_category(self, request, category_id):
+        try:
+            # get the category
+            categories = await self.get_category_map()
+            category_type = categories.get(category_id)
+
+            if category_type is None:
+                abort(404, 'Category not found.')
+
+            # get and paginate the questions
+            page = await self.paginate_category(request, category_id)
+
+            if len(page['questions']) == 0:
+                # return 404
+                abort(404)
+            else:
+                # return 200
+                return {
+                    **page,
+                    'currentCategory': category_type
+                }
+        except Exception as error:
+            # internal server error
+            print(f'GET /categories/<id>/questions error: {error}')
+            abort(500)
+
+    async def play_quiz(self, request):
+        # get body parameters
+        body = request.get_json()
+        quiz_category = body.get('quiz_category', None)
+        previous_questions = body.get('previous_questions', None)
+
+        # check body validity
+        if quiz_category is None or previous_questions is None:
+            abort(
+                400,
+                'Both "quiz_category" and "previous_questions" are required.'
+            )
+
+        # optional target difficulty, and number of questions played
+        # before it goes up by one
+        difficulty = body.get('difficulty', None)
+        ramp = body.get('ramp', None)
+        for name, value in (('difficulty', difficulty), ('ramp', ramp)):
+            if value is not None and (
+                not isinstance(value, int) or isinstance(value, bool)
+                or value < 1
+            ):
+                abort(400, f'"{name}" must be a positive integer.')
+
+        try:
+            # get category id
+            category_id = int(quiz_category.get('id'))
+
+            # select a random question not played yet, of the target
+            # difficulty if any, None when every question has been
+            # played
+            target = None
+            if difficulty is not None or ramp is not None:
+                target = quiz_difficulty(
+                    difficulty,
+                    ramp,
+                    len(previous_questions)
+                )
+            random_question = await self.pick_random_question(
+                category_id,
+                previous_questions,
+                target
+            )
+            return {
+                'question': random_question
+            }, 200
+        except Exception as error:
+            # internal server error
+            print(f'POST /quizzes error: {error}')
+            abort(500)
+
+    async def create_quiz_session(self, request):
+        # get body parameters
+        body = request.get_json()
+        if body is None or body.get('quiz_category') is None:
+            abort(400, '"quiz_category" is required.')
+
+        try:
+            # get category id
+            category_id = int(body['quiz_category'].get('id'))
+
+            # shuffle the questions of the category
+            if category_id == 0:
+                rows = await self.database.fetch(
+                    'SELECT id FROM questions ORDER BY id'
+                )
+            else:
+                rows = await self.database.fetch(
+                    'SELECT id FROM questions WHERE category = $1 '
+                    'ORDER BY id',
+                    category_id
+                )
+            ids = [row[0] for row in rows]
+            session_id = self.quiz_sessions.create(ids)
+
+            # created
+            return {
+                'session_id': session_id,
+                'totalQuestions': len(ids)
+            }, 201
+        except Exception as error:
+            # internal server error
+            print(f'POST /quizzes/sessions error: {error}')
+            abort(500)
+
+    async def next_quiz_question(self, request, session_id):
+        # skip the questions deleted since the session was created
+        while True:
+            try:
+                id, remaining = self.quiz_sessions.next(session_id)
+            except KeyError:
+                abort(404, 'Quiz session not found.')
+            if id is None:
+                question, remaining = None, 0
+                break
+            question = await self.load_question(id)
+            if question is not None:
+                break
+
+        return {
+            'question': question,
+            'remaining': remaining
+        }, 200
+
+    async def delete_quiz_session(self, request, session_id):
+        if not self.quiz_sessions.delete(session_id):
+            abort(404, 'Quiz session not found.')
+
+        return {
+            'deleted': session_id
+        }
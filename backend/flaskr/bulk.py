@@ -0,0 +1,338 @@
+import csv
+import io
+import json
+
+import click
+
+from models import (
+    db,
+    Question,
+    Category,
+    notify_question_listeners,
+    batched_writes,
+    delete_questions
+)
+
+IMPORT_FORMATS = ('jsonl', 'csv')
+IMPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = IMPORT_FORMATS
+EXPORT_MIMETYPES = {'jsonl': 'application/x-ndjson', 'csv': 'text/csv'}
+# rows fetched at a time by the server-side cursor of an export
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 64 * 1024
+# errors listed in an import report, the others are only counted
+MAX_REPORTED_ERRORS = 1000
+# operations of a POST /questions/batch request
+MAX_BATCH_OPERATIONS = 1000
+BATCH_OPERATIONS = ('insert', 'delete')
+
+COLUMNS = ('question', 'answer', 'category', 'difficulty')
+EXPORT_COLUMNS = ('id',) + COLUMNS
+
+
+def read_rows(lines, format):
+    """
+    read_rows(lines, format)
+        yields (row number, dict or error message) for every row of
+        an iterable of text lines, either JSON lines or CSV with a
+        header line naming the columns
+    """
+    if format == 'csv':
+        for number, row in enumerate(csv.DictReader(lines), start=1):
+            yield number, row
+        return
+
+    number = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield number, f'Invalid JSON: {error}'
+            continue
+        if not isinstance(row, dict):
+            yield number, 'Row is not a JSON object.'
+            continue
+        yield number, row
+
+
+def validate_row(row, categories):
+    """
+    validate_row(row, categories)
+        returns the (question, answer, category, difficulty) values of
+        a row, raises ValueError when the row can't be imported
+    """
+    question = row.get('question')
+    answer = row.get('answer')
+    if not isinstance(question, str) or not question.strip():
+        raise ValueError('"question" is required.')
+    if not isinstance(answer, str) or not answer.strip():
+        raise ValueError('"answer" is required.')
+
+    try:
+        category = int(row.get('category'))
+    except (TypeError, ValueError):
+        raise ValueError('"category" must be a category id.')
+    if category not in categories:
+        raise ValueError('Category is not correct.')
+
+    try:
+        difficulty = int(row.get('difficulty') or 1)
+    except (TypeError, ValueError):
+        raise ValueError('"difficulty" must be an integer.')
+
+    return question, answer, category, difficulty
+
+
+def import_questions(rows, batch_size=IMPORT_BATCH_SIZE):
+    """
+    import_questions(rows, batch_size)
+        loads the (row number, row) pairs given by read_rows and
+        returns a report {'imported', 'failed', 'errors'}.
+        Categories are checked against the cached category map,
+        valid rows are written batch_size at a time, each batch in
+        its own transaction. Invalid rows are reported and skipped;
+        when a batch is rejected by the database its rows are written
+        one by one so only the faulty ones are reported.
+        Text that is not UTF-8 stops the import: the rows read before
+        it are still written and the report gets an 'aborted'
+        message. Listeners are notified of whatever was committed,
+        even when the import fails.
+    """
+    categories = Category.get_map()
+    report = {'imported': 0, 'failed': 0, 'errors': []}
+
+    def fail(number, error):
+        report['failed'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'row': number, 'error': str(error)})
+
+    batch = []
+    try:
+        try:
+            for number, row in rows:
+                if isinstance(row, str):
+                    fail(number, row)
+                    continue
+                try:
+                    batch.append((number, validate_row(row, categories)))
+                except ValueError as error:
+                    fail(number, error)
+                    continue
+
+                if len(batch) >= batch_size:
+                    _write_batch(batch, report, fail)
+                    batch = []
+        except UnicodeDecodeError:
+            report['aborted'] = 'Body is not UTF-8 text.'
+
+        if batch:
+            _write_batch(batch, report, fail)
+    finally:
+        # the batches are committed as they go
+        if report['imported']:
+            notify_question_listeners('reload', None)
+
+    return report
+
+
+def _write_batch(batch, report, fail):
+    try:
+        _insert_values([values for _, values in batch])
+        db.session.commit()
+        report['imported'] += len(batch)
+        return
+    except Exception:
+        db.session.rollback()
+
+    # find the rows rejected by the database
+    for number, values in batch:
+        try:
+            _insert_values([values])
+            db.session.commit()
+            report['imported'] += 1
+        except Exception as error:
+            db.session.rollback()
+            fail(number, error)
+
+
+def _insert_values(values):
+    connection = db.session.connection()
+
+    if connection.dialect.name == 'postgresql':
+        # COPY the batch through the connection of the transaction
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(values)
+        buffer.seek(0)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(
+            f'COPY {Question.__tablename__} ({", ".join(COLUMNS)}) '
+            'FROM STDIN WITH (FORMAT csv)',
+            buffer
+        )
+        cursor.close()
+    else:
+        connection.execute(
+            Question.__table__.insert(),
+            [dict(zip(COLUMNS, row)) for row in values]
+        )
+
+
+def apply_question_batch(operations):
+    """
+    apply_question_batch(operations)
+        runs a list of {'op': 'insert', <question fields>} and
+        {'op': 'delete', 'id': <id>} operations in one transaction
+        and returns one result per operation, in order: the id of
+        the inserted question, or the id and whether it was deleted.
+        Deletes run as a single DELETE of all their ids. Raises
+        ValueError naming the first invalid operation, before
+        anything is written.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise ValueError('"operations" must be a non-empty list.')
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise ValueError(
+            f'At most {MAX_BATCH_OPERATIONS} operations per batch.'
+        )
+
+    # validate everything first
+    categories = Category.get_map()
+    checked = []
+    for number, operation in enumerate(operations):
+        try:
+            if not isinstance(operation, dict):
+                raise ValueError('Operation is not a JSON object.')
+            op = operation.get('op')
+            if op == 'insert':
+                checked.append((op, validate_row(operation, categories)))
+            elif op == 'delete':
+                id = operation.get('id')
+                if not isinstance(id, int) or isinstance(id, bool):
+                    raise ValueError('"id" must be a question id.')
+                checked.append((op, id))
+            else:
+                raise ValueError(
+                    f'"op" must be one of {", ".join(BATCH_OPERATIONS)}.'
+                )
+        except ValueError as error:
+            raise ValueError(f'Operation {number}: {error}')
+
+    with batched_writes():
+        inserted = []
+        for op, values in checked:
+            if op == 'insert':
+                question = Question(*values)
+                question.insert()
+                inserted.append(question)
+        # ids are known once flushed, before the commit expires them
+        inserted_ids = [question.id for question in inserted]
+        deleted = set(delete_questions(
+            {values for op, values in checked if op == 'delete'}
+        ))
+
+    results = []
+    inserted_ids = iter(inserted_ids)
+    for op, values in checked:
+        if op == 'insert':
+            results.append({'op': op, 'id': next(inserted_ids)})
+        else:
+            results.append({
+                'op': op,
+                'id': values,
+                'deleted': values in deleted
+            })
+    return results
+
+
+def export_questions(format, category=None, difficulty=None):
+    """
+    export_questions(format, category, difficulty)
+        yields the questions ordered by id as text lines, JSON lines
+        or CSV with a header line, optionally only the ones of a
+        category and/or a difficulty.
+        Rows are read as plain tuples through a server-side cursor,
+        EXPORT_BATCH_SIZE at a time, so memory does not grow with
+        the number of questions.
+    """
+    query = db.session.query(
+        *(getattr(Question, column) for column in EXPORT_COLUMNS)
+    )
+    if category is not None:
+        query = query.filter(Question.category == category)
+    if difficulty is not None:
+        query = query.filter(Question.difficulty == difficulty)
+    rows = query.order_by(Question.id).yield_per(EXPORT_BATCH_SIZE)
+
+    # lines are sent in chunks of about EXPORT_CHUNK_SIZE characters
+    buffer = io.StringIO()
+    if format == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        write = writer.writerow
+    else:
+        def write(row):
+            buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n')
+
+    for row in rows:
+        write(row)
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def register_bulk_commands(app):
+    """
+    register_bulk_commands(app)
+        adds the bulk commands to the flask command line
+    """
+    @app.cli.command('import-questions')
+    @click.argument('source', type=click.File('r', encoding='utf-8'))
+    @click.option(
+        '--format',
+        type=click.Choice(IMPORT_FORMATS),
+        help='Format of the file, guessed from its extension by default.'
+    )
+    @click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True)
+    def import_questions_command(source, format, batch_size):
+        """Import questions from a JSON lines or CSV file (- for stdin)."""
+        if format is None:
+            format = 'csv' if source.name.endswith('.csv') else 'jsonl'
+
+        report = import_questions(read_rows(source, format), batch_size)
+
+        for error in report['errors']:
+            click.echo(f'row {error["row"]}: {error["error"]}', err=True)
+        click.echo(
+            f'{report["imported"]} questions imported, '
+            f'{report["failed"]} rows failed.'
+        )
+        if 'aborted' in report:
+            raise click.ClickException(report['aborted'])
+
+    @app.cli.command('export-questions')
+    @click.argument(
+        'output',
+        type=click.File('w', encoding='utf-8'),
+        default='-'
+    )
+    @click.option(
+        '--format',
+        type=click.Choice(EXPORT_FORMATS),
+        help='Format of the file, guessed from its extension by default.'
+    )
+    @click.option('--category', type=int, help='Only this category.')
+    @click.option('--difficulty', type=int, help='Only this difficulty.')
+    def export_questions_command(output, format, category, difficulty):
+        """Export questions to a JSON lines or CSV file (stdout by default)."""
+        if format is None:
+            format = 'csv' if output.name.endswith('.csv') else 'jsonl'
+
+        for line in export_questions(format, category, difficulty):
+            output.write(line)
@@ -0,0 +1,81 @@
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional, responses are only gzipped without it
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def _compress_gzip(data):
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def _compress_brotli(data):
+    return brotli.compress(data, quality=BROTLI_QUALITY)
+
+
+# encoding -> compress function, in order of preference
+ENCODINGS = {'gzip': _compress_gzip}
+if brotli is not None:
+    ENCODINGS = {'br': _compress_brotli, **ENCODINGS}
+
+
+def negotiate_encoding(accept_encodings):
+    """
+    negotiate_encoding(accept_encodings)
+        returns the encoding of ENCODINGS with the highest quality in
+        the Accept-Encoding header (brotli first between two as good),
+        or None when the client accepts none of them
+    """
+    best, best_quality = None, 0
+    for encoding in ENCODINGS:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def init_compression(app):
+    """
+    init_compression(app)
+        compresses the responses of the app whose body is at least
+        COMPRESSION_MIN_SIZE bytes with brotli (when installed) or
+        gzip, as negotiated with the Accept-Encoding header.
+        Streamed responses (the exports) are sent as they are. The
+        ETag of a compressed response is made weak, so a client can
+        revalidate it with the uncompressed one and get a 304.
+    """
+    min_size = app.config['COMPRESSION_MIN_SIZE']
+
+    @app.after_request
+    def compress_response(response):
+        if (
+            response.status_code < 200
+            or response.status_code in (204, 304)
+            or response.direct_passthrough
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers
+        ):
+            return response
+
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+
+        # the body depends on Accept-Encoding from here on
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        response.set_data(ENCODINGS[encoding](data))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,60 @@
+import functools
+import hashlib
+
+from flask import current_app, request
+
+from models import data_version, use_primary
+
+
+def cached_response(view):
+    """
+    cached_response(view)
+        caches the 200 responses of a GET view in the cache backend
+        when RESPONSE_CACHE is enabled, keyed by the data version and
+        the request path with its query string, so any question or
+        category write invalidates every entry. Entries are rendered
+        from the primary, never from a lagging replica: the replica
+        only serves these views with RESPONSE_CACHE disabled.
+        Responses carry a strong ETag and a Cache-Control header, a
+        request whose If-None-Match matches gets a 304 without body.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        cache = current_app.extensions.get('response_cache')
+        if cache is None:
+            return view(*args, **kwargs)
+
+        # the version is read first, a write during the view moves
+        # it on and the entry stored below is never read again
+        key = f'response:{data_version()}:{request.full_path}'
+        entry = cache.get(key)
+        if entry is None:
+            # rendered from the primary, a lagging replica would store
+            # old data under the new version
+            with use_primary():
+                response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+            body = response.get_data()
+            entry = (body, hashlib.sha1(body).hexdigest())
+            cache.set(key, entry, current_app.config['CACHE_TTL'])
+
+        body, etag = entry
+        response = current_app.response_class(
+            body,
+            mimetype='application/json'
+        )
+        response.set_etag(etag)
+
+        max_age = current_app.config['RESPONSE_CACHE_MAX_AGE']
+        if max_age > 0:
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+        else:
+            response.cache_control.no_cache = True
+
+        # answers 304 when If-None-Match matches the ETag
+        return response.make_conditional(request)
+
+    return wrapper
@@ -0,0 +1,221 @@
+import threading
+import time
+
+from flask import Response, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PROMETHEUS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# name -> (help, bucket upper bounds) of the per-request histograms
+HISTOGRAMS = {
+    'trivia_request_duration_seconds': (
+        'Time to handle a request.',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    ),
+    'trivia_request_queries': (
+        'SQL statements run by a request.',
+        (0, 1, 2, 3, 5, 10, 25, 50, 100)
+    ),
+    'trivia_request_query_duration_seconds': (
+        'Time spent by a request in SQL statements.',
+        (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+    ),
+    'trivia_request_rows': (
+        'Rows fetched from the database by a request.',
+        (0, 1, 10, 100, 1000, 10000, 100000)
+    ),
+    'trivia_response_bytes': (
+        'Size of the response body.',
+        (100, 1000, 10000, 100000, 1000000)
+    )
+}
+
+# name -> help of the counters
+COUNTERS = {
+    'trivia_requests_total': 'Requests handled, by status.',
+    'trivia_slow_requests_total': 'Requests slower than SLOW_REQUEST_MS.'
+}
+
+
+class MetricsRegistry:
+    """
+    In-process store of the counters and histograms, rendered in the
+    Prometheus text format. Every worker process has its own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (name, labels) -> value
+        self._counters = {}
+        # (name, labels) -> [count per bucket, sum, count]
+        self._histograms = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = [[0] * len(buckets), 0, 0]
+                self._histograms[key] = histogram
+            for position, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[0][position] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    def render(self):
+        """
+        returns the metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, (list(value[0]), value[1], value[2]))
+                for key, value in self._histograms.items()
+            )
+
+        lines = []
+        for name, help in COUNTERS.items():
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} counter')
+            for (counter, labels), value in counters:
+                if counter == name:
+                    lines.append(f'{name}{_labels(labels)} {value}')
+
+        for name, (help, buckets) in HISTOGRAMS.items():
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} histogram')
+            for (histogram, labels), (counts, total, count) in histograms:
+                if histogram != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(
+                        f'{name}_bucket'
+                        f'{_labels(labels + (("le", bound),))} {cumulative}'
+                    )
+                lines.append(
+                    f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} '
+                    f'{count}'
+                )
+                lines.append(f'{name}_sum{_labels(labels)} {total}')
+                lines.append(f'{name}_count{_labels(labels)} {count}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def init_metrics(app):
+    """
+    init_metrics(app)
+        records the latency, SQL statements, SQL time, rows fetched
+        and response size of every request of the app in a
+        MetricsRegistry, served on GET /metrics.
+        Requests slower than SLOW_REQUEST_MS are logged as warnings.
+    """
+    registry = MetricsRegistry()
+    app.extensions['metrics'] = registry
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_metrics = {
+            'start': time.perf_counter(),
+            'queries': 0,
+            'query_time': 0.0,
+            'rows': 0
+        }
+
+    @app.after_request
+    def record_request_metrics(response):
+        metrics = g.pop('request_metrics', None)
+        if metrics is None or request.endpoint == 'metrics':
+            return response
+
+        duration = time.perf_counter() - metrics['start']
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        labels = (('method', request.method), ('route', route))
+
+        registry.inc(
+            'trivia_requests_total',
+            labels + (('status', response.status_code),)
+        )
+        registry.observe('trivia_request_duration_seconds', labels, duration)
+        registry.observe('trivia_request_queries', labels, metrics['queries'])
+        registry.observe(
+            'trivia_request_query_duration_seconds',
+            labels,
+            metrics['query_time']
+        )
+        registry.observe('trivia_request_rows', labels, metrics['rows'])
+        # streamed responses have no length
+        if not response.is_streamed:
+            registry.observe(
+                'trivia_response_bytes',
+                labels,
+                response.calculate_content_length() or 0
+            )
+
+        threshold = app.config['SLOW_REQUEST_MS']
+        if threshold and duration * 1000 >= threshold:
+            registry.inc('trivia_slow_requests_total', labels)
+            app.logger.warning(
+                f'slow request: {request.method} {request.full_path} '
+                f'{response.status_code} in {duration * 1000:.1f} ms, '
+                f'{metrics["queries"]} queries '
+                f'({metrics["query_time"] * 1000:.1f} ms), '
+                f'{metrics["rows"]} rows'
+            )
+
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(registry.render(), mimetype=PROMETHEUS_MIMETYPE)
+
+
+# SQL statements are counted for the request running them, on every
+# engine (the primary and the replica of setup_db); statements run
+# outside of an instrumented request are ignored
+def _request_metrics():
+    if has_app_context():
+        return g.get('request_metrics')
+    return None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(connection, cursor, statement, parameters,
+                           context, executemany):
+    if _request_metrics() is not None:
+        context._metrics_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(connection, cursor, statement, parameters,
+                          context, executemany):
+    metrics = _request_metrics()
+    start = getattr(context, '_metrics_start', None)
+    if metrics is None or start is None:
+        return
+
+    metrics['queries'] += 1
+    metrics['query_time'] += time.perf_counter() - start
+    # rowcount is the number of rows of a buffered SELECT, -1 when
+    # the rows are streamed
+    if cursor.description is not None and cursor.rowcount > 0:
+        metrics['rows'] += cursor.rowcount
@@ -0,0 +1,218 @@
+import bisect
+
+from flask import current_app
+
+from models import (
+    Question,
+    QUESTION_FIELDS,
+    question_rows,
+    format_question_row,
+    use_primary
+)
+from .question_index import get_question_index
+from .stats import question_counts
+
+QUESTIONS_PER_PAGE = 10
+MAX_QUESTIONS_PER_PAGE = 100
+
+
+def paginate_questions(request, query):
+    """
+    paginate_questions(request, query)
+        returns the questions of the requested page of a query
+        ordered by Question.id, as a dict with the keys
+        'questions' and 'totalQuestions'.
+        Only the page itself is loaded, as plain column tuples, the
+        total comes from a separate COUNT.
+        By default pages are selected with ?page=N (LIMIT/OFFSET).
+        Passing ?after_id=<id>&limit=N switches to keyset mode:
+        the page seeks on the primary key and the result also
+        carries 'next_cursor', the after_id of the next page
+        (None on the last one).
+        ?per_page=N sets the page size (1 to 100, 10 by default) and
+        ?fields=a,b keeps only these fields of the questions, see
+        question_fields.
+    """
+    # count the rows without the ordering
+    total = query.order_by(None).count()
+
+    if 'after_id' in request.args:
+        return _paginate_by_cursor(request, query, total)
+
+    # get page
+    start = _page_start(request)
+
+    # pages before the first one are always empty
+    if start < 0:
+        return {'questions': [], 'totalQuestions': total}
+
+    # load only the requested page and fields
+    fields = question_fields(request)
+    rows = query.with_entities(*_columns(fields)).offset(start).limit(
+        _per_page(request)
+    ).all()
+
+    return {
+        'questions': [format_question_row(row, fields) for row in rows],
+        'totalQuestions': total
+    }
+
+
+def paginate_category(request, category_id):
+    """
+    paginate_category(request, category_id)
+        returns the requested page of the questions of a category
+        (all categories when category_id is 0) ordered by id.
+        With QUESTION_INDEX enabled the total and the ids of the
+        page come from the question index and only the page is read
+        from the database.
+    """
+    if current_app.config['QUESTION_INDEX']:
+        ids = get_question_index(current_app).ids(category_id)
+        return paginate_ids(request, ids)
+
+    query = Question.query
+    if category_id != 0:
+        query = query.filter(Question.category == category_id)
+    return paginate_questions(request, query.order_by(Question.id))
+
+
+def category_counts():
+    """
+    category_counts()
+        returns {category id: number of questions}, categories
+        without questions left out.
+        With QUESTION_INDEX enabled the counts are the lengths of the
+        index arrays, otherwise they are summed from the cached
+        GROUP BY of question_counts().
+    """
+    if current_app.config['QUESTION_INDEX']:
+        index = get_question_index(current_app)
+        return {
+            category: index.count(category)
+            for category in index.categories()
+        }
+
+    counts = {}
+    for category, difficulty, count in question_counts():
+        if category is not None:
+            counts[category] = counts.get(category, 0) + count
+    return counts
+
+
+def paginate_ids(request, ids):
+    """
+    paginate_ids(request, ids)
+        same as paginate_questions for a list of question ids that
+        is already in result order (ascending in keyset mode).
+        Only the questions of the requested page are loaded, those
+        missing from a lagging replica from the primary.
+    """
+    total = len(ids)
+
+    if 'after_id' in request.args:
+        # get cursor and page size
+        after_id, limit = _cursor_args(request)
+
+        # seek in the sorted ids, one extra id tells if there is more
+        start = bisect.bisect_right(ids, after_id)
+        page_ids = ids[start:start + limit + 1]
+        has_more = len(page_ids) > limit
+        page_ids = page_ids[:limit]
+    else:
+        # get page
+        start = _page_start(request)
+        end = start + _per_page(request)
+        page_ids = ids[start:end] if start >= 0 else []
+
+    # load only the requested page and fields, in the order of the ids
+    fields = question_fields(request)
+    page_ids = list(page_ids)
+    rows = {}
+    if page_ids:
+        rows = {
+            row.id: row
+            for row in question_rows(fields).filter(
+                Question.id.in_(page_ids)
+            )
+        }
+        # ids the replica does not have yet are read from the primary
+        missing = [id for id in page_ids if id not in rows]
+        if missing:
+            with use_primary():
+                rows.update(
+                    (row.id, row)
+                    for row in question_rows(fields).filter(
+                        Question.id.in_(missing)
+                    )
+                )
+    questions = [
+        format_question_row(rows[id], fields)
+        for id in page_ids if id in rows
+    ]
+
+    page = {
+        'questions': questions,
+        'totalQuestions': total
+    }
+    if 'after_id' in request.args:
+        page['next_cursor'] = page_ids[-1] if has_more else None
+
+    return page
+
+
+def question_fields(request):
+    """
+    question_fields(request)
+        returns the fields of the questions asked for with
+        ?fields=a,b (all of them by default), in the order of
+        QUESTION_FIELDS. id is always kept, unknown names are
+        ignored.
+    """
+    names = request.args.get('fields')
+    if not names:
+        return QUESTION_FIELDS
+    names = {name.strip() for name in names.split(',')}
+    return tuple(
+        field for field in QUESTION_FIELDS
+        if field == 'id' or field in names
+    )
+
+
+def _columns(fields):
+    return [getattr(Question, field) for field in fields]
+
+
+def _per_page(request):
+    per_page = request.args.get('per_page', QUESTIONS_PER_PAGE, type=int)
+    return min(max(per_page, 1), MAX_QUESTIONS_PER_PAGE)
+
+
+def _page_start(request):
+    page = request.args.get('page', 1, type=int)
+    return (page - 1) * _per_page(request)
+
+
+def _cursor_args(request):
+    after_id = request.args.get('after_id', 0, type=int)
+    limit = request.args.get('limit', _per_page(request), type=int)
+    return after_id, min(max(limit, 1), MAX_QUESTIONS_PER_PAGE)
+
+
+def _paginate_by_cursor(request, query, total):
+    # get cursor and page size
+    after_id, limit = _cursor_args(request)
+
+    # seek on the primary key, one extra row tells if there is more
+    fields = question_fields(request)
+    rows = query.with_entities(*_columns(fields)).filter(
+        Question.id > after_id
+    ).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    return {
+        'questions': [format_question_row(row, fields) for row in rows],
+        'totalQuestions': total,
+        'next_cursor': rows[-1].id if has_more else None
+    }
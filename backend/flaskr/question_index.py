@@ -0,0 +1,241 @@
+import bisect
+import random
+import threading
+import time
+from array import array
+
+from flask import current_app, has_app_context
+
+from models import (
+    db,
+    Question,
+    data_version,
+    question_listeners,
+    use_primary
+)
+
+# category id of the whole question bank
+ALL_CATEGORIES = 0
+
+
+class QuestionIndex:
+    """
+    In-memory index of the question ids by category and by
+    (category, difficulty), category 0 holding every question.
+    Ids are kept sorted in compact array('i') so counts, random
+    picks and pages of ids never load ORM objects.
+    version is the data version the index reflects, loaded the
+    time.monotonic() of its creation.
+    """
+
+    def __init__(self, version=None):
+        self.version = version
+        self.loaded = time.monotonic()
+        self._lock = threading.Lock()
+        # category -> ids, (category, difficulty) -> ids
+        self._categories = {ALL_CATEGORIES: array('i')}
+        self._buckets = {}
+
+    def build(self, rows):
+        """
+        fills the index with rows of (id, category, difficulty)
+        ordered by id
+        """
+        with self._lock:
+            for id, category, difficulty in rows:
+                for ids in self._arrays(category, difficulty):
+                    ids.append(id)
+
+    def add(self, id, category, difficulty):
+        with self._lock:
+            self._remove(id)
+            for ids in self._arrays(category, difficulty):
+                # new ids are usually the highest ones
+                if not ids or ids[-1] < id:
+                    ids.append(id)
+                else:
+                    ids.insert(bisect.bisect_left(ids, id), id)
+
+    def remove(self, id):
+        with self._lock:
+            self._remove(id)
+
+    def ids(self, category=ALL_CATEGORIES, difficulty=None):
+        """
+        returns the sorted ids of a category, or of one of its
+        difficulties; callers must not modify them
+        """
+        if difficulty is None:
+            return self._categories.get(category, array('i'))
+        return self._buckets.get((category, difficulty), array('i'))
+
+    def count(self, category=ALL_CATEGORIES, difficulty=None):
+        return len(self.ids(category, difficulty))
+
+    def categories(self):
+        """
+        returns the ids of the categories having questions
+        """
+        return [
+            category for category, ids in self._categories.items()
+            if category != ALL_CATEGORIES and ids
+        ]
+
+    def difficulties(self, category=ALL_CATEGORIES):
+        """
+        returns {difficulty: count} for a category
+        """
+        return {
+            difficulty: len(ids)
+            for (bucket_category, difficulty), ids in self._buckets.items()
+            if bucket_category == category and ids
+        }
+
+    def random_id(self, category=ALL_CATEGORIES, exclude=(),
+                  difficulty=None):
+        """
+        returns a random id of the category not in exclude (a set),
+        or None when there is none left
+        """
+        return random_id(self.ids(category, difficulty), exclude)
+
+    def __contains__(self, id):
+        ids = self._categories[ALL_CATEGORIES]
+        position = bisect.bisect_left(ids, id)
+        return position < len(ids) and ids[position] == id
+
+    def _arrays(self, category, difficulty):
+        keys = [ALL_CATEGORIES]
+        if category is not None:
+            keys.append(int(category))
+        if difficulty is not None:
+            difficulty = int(difficulty)
+        for key in keys:
+            yield self._categories.setdefault(key, array('i'))
+            if difficulty is not None:
+                yield self._buckets.setdefault((key, difficulty), array('i'))
+
+    def _remove(self, id):
+        for ids in list(self._categories.values()) + list(
+            self._buckets.values()
+        ):
+            position = bisect.bisect_left(ids, id)
+            if position < len(ids) and ids[position] == id:
+                del ids[position]
+
+
+def random_id(ids, exclude=(), tries=8):
+    """
+    random_id(ids, exclude, tries)
+        returns a random id of ids not in exclude (a set), or None
+        when there is none left. Ids are drawn until one outside
+        exclude comes out, which is quick as long as most ids are
+        not excluded; after tries draws the remaining ids are
+        filtered.
+    """
+    for _ in range(tries):
+        if not ids:
+            return None
+        id = random.choice(ids)
+        if id not in exclude:
+            return id
+
+    remaining = [id for id in ids if id not in exclude]
+    return random.choice(remaining) if remaining else None
+
+
+def load_index(app, name, build):
+    """
+    load_index(app, name, build)
+        returns the index stored in app.extensions[name], made with
+        build(version) on first use and made again when the data
+        version changed or after CACHE_TTL seconds, so writes of
+        workers not sharing the cache backend show up too.
+        One thread rebuilds at a time: the others keep serving the
+        previous index meanwhile, or wait for the first one.
+    """
+    version = data_version()
+    index = app.extensions.get(name)
+    if index is not None and _is_fresh(app, index, version):
+        return index
+
+    locks = app.extensions.setdefault('index_locks', {})
+    lock = locks.setdefault(name, threading.Lock())
+    if not lock.acquire(blocking=index is None):
+        # being rebuilt by another thread
+        return index
+    try:
+        # rebuilt by another thread while this one waited
+        current = app.extensions.get(name)
+        if current is not None and current is not index and _is_fresh(
+            app,
+            current,
+            data_version()
+        ):
+            return current
+
+        index = build(version)
+        app.extensions[name] = index
+        return index
+    finally:
+        lock.release()
+
+
+def _is_fresh(app, index, version):
+    ttl = app.config.get('CACHE_TTL')
+    return index.version == version and (
+        not ttl or time.monotonic() - index.loaded < ttl
+    )
+
+
+def get_question_index(app):
+    """
+    get_question_index(app)
+        returns the QuestionIndex of the app, see load_index, loaded
+        with one SELECT id, category, difficulty read from the
+        primary
+    """
+    def build(version):
+        index = QuestionIndex(version)
+        # from the primary, the replica can lag behind the version
+        with use_primary():
+            index.build(
+                db.session.query(
+                    Question.id,
+                    Question.category,
+                    Question.difficulty
+                ).order_by(Question.id).yield_per(10000)
+            )
+        return index
+
+    return load_index(app, 'question_index', build)
+
+
+def update_question_index(action, question, versions):
+    """
+    keeps the question index of the current app in sync with the
+    committed question inserts, updates and deletes of this worker
+    """
+    if not has_app_context():
+        return
+    index = current_app.extensions.get('question_index')
+    if index is None:
+        return
+
+    # after a reload the index is rebuilt on next use, and served
+    # until then
+    if action == 'reload':
+        index.version = None
+        return
+
+    if action == 'delete':
+        index.remove(question.id)
+    else:
+        index.add(question.id, question.category, question.difficulty)
+    # an index that missed writes of another worker keeps its old
+    # version, it is rebuilt on next use
+    if index.version == versions[0]:
+        index.version = versions[1]
+
+
+question_listeners.append(update_question_index)
@@ -0,0 +1,275 @@
+import random
+import secrets
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import func
+
+from models import (
+    db,
+    Question,
+    get_cache,
+    data_version,
+    question_rows,
+    format_question_row,
+    use_primary
+)
+from .question_index import get_question_index, random_id
+
+
+def pick_random_question(category_id, previous_questions):
+    """
+    pick_random_question(category_id, previous_questions)
+        returns a random question of the category (all categories
+        when category_id is 0) whose id is not in previous_questions,
+        as the dict of Question.format(), or None when every question
+        has been played.
+        The pick is drawn from the candidate ids, then only that
+        question is read by primary key, as a plain row.
+    """
+    ids = get_candidate_ids(category_id)
+    id = random_id(ids, set(previous_questions or ()))
+    if id is None:
+        return None
+
+    question = load_question(id)
+    if question is None:
+        # deleted since the candidates were cached
+        return pick_in_database(category_id, previous_questions)
+    return question
+
+
+def pick_adaptive_question(category_id, previous_questions, difficulty):
+    """
+    pick_adaptive_question(category_id, previous_questions, difficulty)
+        same as pick_random_question for a target difficulty: the
+        question is drawn from the (category, difficulty) bucket of
+        the question index, and when that bucket is played out from
+        the nearest difficulty that still has questions.
+        Each draw picks a random id of a bucket, whatever the number
+        of questions.
+    """
+    if not current_app.config['QUESTION_INDEX']:
+        return pick_in_database(category_id, previous_questions, difficulty)
+
+    index = get_question_index(current_app)
+    exclude = set(previous_questions or ())
+    for bucket in nearest_difficulties(
+        difficulty,
+        index.difficulties(category_id)
+    ):
+        id = index.random_id(category_id, exclude, difficulty=bucket)
+        if id is None:
+            continue
+
+        question = load_question(id)
+        if question is None:
+            # deleted since the index was loaded
+            return pick_in_database(
+                category_id,
+                previous_questions,
+                difficulty
+            )
+        return question
+
+    return None
+
+
+def nearest_difficulties(difficulty, difficulties):
+    """
+    nearest_difficulties(difficulty, difficulties)
+        returns the difficulties ordered by distance from the target
+        difficulty, the easier one first between two as near
+    """
+    return sorted(
+        difficulties,
+        key=lambda bucket: (abs(bucket - difficulty), bucket)
+    )
+
+
+def quiz_difficulty(difficulty=None, ramp=None, played=0):
+    """
+    quiz_difficulty(difficulty, ramp, played)
+        returns the target difficulty of the next question: the
+        difficulty asked for (1 by default), raised by one every ramp
+        questions played when ramp is given
+    """
+    difficulty = 1 if difficulty is None else difficulty
+    if ramp:
+        difficulty += played // ramp
+    return difficulty
+
+
+def load_question(id):
+    """
+    load_question(id)
+        returns the question as the dict of Question.format(), or
+        None when it does not exist
+    """
+    row = question_rows().filter(Question.id == id).first()
+    return None if row is None else format_question_row(row)
+
+
+def get_candidate_ids(category_id):
+    """
+    get_candidate_ids(category_id)
+        returns the sorted array of the question ids of the category
+        (all categories when category_id is 0), from the question
+        index or, when QUESTION_INDEX is disabled, cached in the cache
+        backend until the next question write
+    """
+    if current_app.config['QUESTION_INDEX']:
+        return get_question_index(current_app).ids(category_id)
+
+    key = f'quiz:{data_version()}:{category_id}'
+    cache = get_cache()
+    ids = cache.get(key)
+    if ids is None:
+        query = db.session.query(Question.id)
+        if category_id != 0:
+            query = query.filter(Question.category == category_id)
+        with use_primary():
+            ids = array('i', (row.id for row in query.order_by(Question.id)))
+        cache.set(key, ids, current_app.config['CACHE_TTL'])
+    return ids
+
+
+class QuizSessionStore:
+    """
+    In-process store of the quiz sessions. A session holds the deck
+    of the question ids of its category, shuffled once at creation,
+    as a compact array('i') and the position of the next question,
+    so drawing a question is O(1) whatever the number played.
+    Sessions expire ttl seconds after their last use, the oldest
+    ones are dropped beyond max_sessions.
+    """
+
+    def __init__(self, ttl=3600, max_sessions=10000):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        # session id -> [expiry, position, deck], least recent first
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, ids):
+        """
+        creates a session over a shuffled copy of ids and returns
+        its id
+        """
+        deck = array('i', ids)
+        random.shuffle(deck)
+        session_id = secrets.token_urlsafe(16)
+
+        with self._lock:
+            self._evict()
+            self._sessions[session_id] = [self._expiry(), 0, deck]
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+        return session_id
+
+    def next(self, session_id):
+        """
+        returns (next question id or None when the deck is
+        exhausted, number of ids left), raises KeyError for an
+        unknown or expired session
+        """
+        with self._lock:
+            self._evict()
+            session = self._sessions[session_id]
+            session[0] = self._expiry()
+            self._sessions.move_to_end(session_id)
+
+            position, deck = session[1], session[2]
+            if position >= len(deck):
+                return None, 0
+            session[1] = position + 1
+            return deck[position], len(deck) - position - 1
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _expiry(self):
+        return time.monotonic() + self.ttl
+
+    def _evict(self):
+        # sessions are kept in order of use, the expired ones first
+        now = time.monotonic()
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session[0] > now:
+                break
+            del self._sessions[session_id]
+
+
+def next_session_question(store, session_id):
+    """
+    next_session_question(store, session_id)
+        returns (next question of the session or None, number of
+        questions left), skipping the questions deleted since the
+        session was created
+    """
+    while True:
+        id, remaining = store.next(session_id)
+        if id is None:
+            return None, 0
+        question = load_question(id)
+        if question is not None:
+            return question, remaining
+
+
+def pick_in_database(category_id, previous_questions, difficulty=None):
+    """
+    pick_in_database(category_id, previous_questions, difficulty)
+        same as pick_random_question without the cache: the
+        exclusion and the pick both run in the database, one COUNT
+        for the candidates and one row fetched at a random offset.
+        With a target difficulty, the questions left are first
+        counted by difficulty to pick from the nearest one.
+    """
+    # base query
+    query = question_rows()
+
+    # filter by category
+    if category_id != 0:
+        query = query.filter(Question.category == category_id)
+
+    # filter out previous questions
+    if previous_questions:
+        query = query.filter(~Question.id.in_(previous_questions))
+
+    # filter by the nearest difficulty having questions left
+    if difficulty is not None:
+        counts = query.with_entities(
+            Question.difficulty,
+            func.count()
+        ).group_by(Question.difficulty).all()
+        buckets = nearest_difficulties(
+            difficulty,
+            [bucket for bucket, count in counts if bucket is not None]
+        )
+        if not buckets:
+            return None
+        query = query.filter(Question.difficulty == buckets[0])
+
+    # a concurrent delete can shrink the candidates between the two
+    # statements, in that case try again with the new count
+    for _ in range(3):
+        count = query.count()
+        if count == 0:
+            return None
+
+        row = query.order_by(Question.id).offset(
+            random.randrange(count)
+        ).limit(1).first()
+        if row is not None:
+            return format_question_row(row)
+
+    return None
@@ -0,0 +1,29 @@
+import click
+
+from models import db, migrate
+
+
+def register_schema_commands(app):
+    """
+    register_schema_commands(app)
+        adds the schema commands to the flask command line
+    """
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create the tables and apply the pending migrations."""
+        # the replica only receives the schema of the primary
+        db.create_all(bind=None)
+        applied = migrate(db.engine)
+
+        click.echo(
+            f'Tables created, {len(applied)} migrations applied.'
+        )
+
+    @app.cli.command('migrate')
+    def migrate_command():
+        """Apply the pending migrations of migrations/."""
+        applied = migrate(db.engine)
+
+        for name in applied:
+            click.echo(f'applied {name}')
+        click.echo(f'{len(applied)} migrations applied.')
@@ -0,0 +1,254 @@
+import re
+import threading
+import time
+
+from flask import current_app, has_app_context
+from sqlalchemy import func
+
+from models import (
+    db,
+    Question,
+    SEARCH_CONFIG,
+    search_vector,
+    question_listeners,
+    use_primary
+)
+from .pagination import paginate_questions, paginate_ids
+from .question_index import load_index
+
+SEARCH_BACKENDS = ('fulltext', 'ilike', 'memory')
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def search_questions(term, search_answers=False, ranked=True):
+    """
+    search_questions(term, search_answers, ranked)
+        returns a Question query matching the search term, ordered
+        by relevance when ranked is True and by id otherwise.
+        'fulltext' uses the GIN tsvector indexes, every word of the
+        term matches as a prefix; 'ilike' is the plain substring
+        scan, for databases without the indexes.
+    """
+    backend = current_app.config['SEARCH_BACKEND']
+    if backend == 'ilike':
+        return _search_ilike(term, search_answers)
+
+    # every word of the term must start a word of the question
+    words = WORD_PATTERN.findall(term)
+    if not words:
+        return Question.query.order_by(Question.id)
+
+    vector = search_vector(search_answers)
+    tsquery = func.to_tsquery(
+        SEARCH_CONFIG,
+        ' & '.join(f'{word}:*' for word in words)
+    )
+    query = Question.query.filter(vector.op('@@')(tsquery))
+
+    if ranked:
+        query = query.order_by(
+            func.ts_rank(vector, tsquery).desc(),
+            Question.id
+        )
+    else:
+        query = query.order_by(Question.id)
+
+    return query
+
+
+def paginate_search(request, term, search_answers=False):
+    """
+    paginate_search(request, term, search_answers)
+        returns the requested page of the search results with the
+        backend chosen by the SEARCH_BACKEND setting: 'fulltext'
+        (default) and 'ilike' run in the database, 'memory' answers
+        from the in-process MemorySearchIndex.
+        Results are ranked unless paging with a cursor.
+    """
+    ranked = 'after_id' not in request.args
+
+    if current_app.config['SEARCH_BACKEND'] == 'memory':
+        ids = get_memory_index(current_app).search(
+            term,
+            search_answers=search_answers,
+            ranked=ranked
+        )
+        return paginate_ids(request, ids)
+
+    query = search_questions(term, search_answers, ranked)
+    return paginate_questions(request, query)
+
+
+def _search_ilike(term, search_answers):
+    condition = Question.question.ilike(f'%{term}%')
+    if search_answers:
+        condition = condition | Question.answer.ilike(f'%{term}%')
+
+    return Question.query.filter(condition).order_by(Question.id)
+
+
+class MemorySearchIndex:
+    """
+    In-process inverted index over the question and answer texts.
+    A search matches the term as a case-insensitive substring,
+    like ILIKE '%term%': the words of the term select the
+    candidate questions through the index of their words, then
+    only the candidates are checked for the whole term.
+    version is the data version the index reflects, loaded the
+    time.monotonic() of its creation.
+    """
+
+    def __init__(self, version=None):
+        self.version = version
+        self.loaded = time.monotonic()
+        self._lock = threading.Lock()
+        # id -> (lowercase question, lowercase answer)
+        self._texts = {}
+        # word -> ids, for the questions and for the answers
+        self._question_words = {}
+        self._answer_words = {}
+
+    def build(self, rows):
+        """
+        replaces the content with rows of (id, question, answer)
+        """
+        with self._lock:
+            self._texts = {}
+            self._question_words = {}
+            self._answer_words = {}
+            for id, question, answer in rows:
+                self._add(id, question, answer)
+
+    def add(self, id, question, answer):
+        with self._lock:
+            self._remove(id)
+            self._add(id, question, answer)
+
+    def remove(self, id):
+        with self._lock:
+            self._remove(id)
+
+    def search(self, term, search_answers=False, ranked=True):
+        """
+        returns the ids of the matching questions; when ranked,
+        the questions matching on their text come before the ones
+        matching only on their answer, otherwise ids are sorted
+        """
+        term = term.lower()
+        words = WORD_PATTERN.findall(term)
+
+        with self._lock:
+            if words:
+                ids = self._candidates(self._question_words, words)
+                if search_answers:
+                    ids |= self._candidates(self._answer_words, words)
+            else:
+                ids = set(self._texts)
+
+            in_question = []
+            in_answer = []
+            for id in sorted(ids):
+                question, answer = self._texts[id]
+                if term in question:
+                    in_question.append(id)
+                elif search_answers and term in answer:
+                    in_answer.append(id)
+
+        if ranked:
+            return in_question + in_answer
+        return sorted(in_question + in_answer)
+
+    def __len__(self):
+        return len(self._texts)
+
+    def _candidates(self, index, words):
+        candidates = None
+        for word in words:
+            # ids of the questions having a word containing this one
+            matches = set()
+            for indexed_word, ids in index.items():
+                if word in indexed_word:
+                    matches |= ids
+            candidates = matches if candidates is None else (
+                candidates & matches
+            )
+            if not candidates:
+                break
+        return candidates
+
+    def _add(self, id, question, answer):
+        question = (question or '').lower()
+        answer = (answer or '').lower()
+        self._texts[id] = (question, answer)
+        for word in set(WORD_PATTERN.findall(question)):
+            self._question_words.setdefault(word, set()).add(id)
+        for word in set(WORD_PATTERN.findall(answer)):
+            self._answer_words.setdefault(word, set()).add(id)
+
+    def _remove(self, id):
+        texts = self._texts.pop(id, None)
+        if texts is None:
+            return
+        for index, text in zip(
+            (self._question_words, self._answer_words),
+            texts
+        ):
+            for word in set(WORD_PATTERN.findall(text)):
+                ids = index.get(word)
+                if ids is not None:
+                    ids.discard(id)
+                    if not ids:
+                        del index[word]
+
+
+def get_memory_index(app):
+    """
+    get_memory_index(app)
+        returns the MemorySearchIndex of the app, see load_index,
+        loaded from the primary
+    """
+    def build(version):
+        index = MemorySearchIndex(version)
+        # from the primary, the replica can lag behind the version
+        with use_primary():
+            index.build(
+                db.session.query(
+                    Question.id,
+                    Question.question,
+                    Question.answer
+                ).yield_per(1000)
+            )
+        return index
+
+    return load_index(app, 'memory_search_index', build)
+
+
+def update_memory_index(action, question, versions):
+    """
+    keeps the memory index of the current app in sync with the
+    committed question inserts, updates and deletes of this worker
+    """
+    if not has_app_context():
+        return
+    index = current_app.extensions.get('memory_search_index')
+    if index is None:
+        return
+
+    # after a reload the index is rebuilt on next use, and served
+    # until then
+    if action == 'reload':
+        index.version = None
+        return
+
+    if action == 'delete':
+        index.remove(question.id)
+    else:
+        index.add(question.id, question.question, question.answer)
+    # an index that missed writes of another worker keeps its old
+    # version, it is rebuilt on next use
+    if index.version == versions[0]:
+        index.version = versions[1]
+
+
+question_listeners.append(update_memory_index)
@@ -0,0 +1,41 @@
+import json
+
+from flask import current_app, jsonify as flask_jsonify
+
+try:
+    import orjson
+except ImportError:  # optional, the standard encoder is used without it
+    orjson = None
+
+
+def dumps(data, fast=True):
+    """
+    dumps(data, fast)
+        encodes data as a JSON body (bytes ending with a newline),
+        with orjson when it is installed and fast is True
+    """
+    if orjson is not None and fast:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS) + b'\n'
+    return (json.dumps(data, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def jsonify(*args, **kwargs):
+    """
+    jsonify(*args, **kwargs)
+        same as flask.jsonify, encoded with orjson when it is
+        installed and the FAST_JSON setting is enabled
+    """
+    if orjson is None or not current_app.config['FAST_JSON']:
+        return flask_jsonify(*args, **kwargs)
+
+    if args and kwargs:
+        raise TypeError('jsonify() takes either args or kwargs, not both')
+    if len(args) == 1:
+        data = args[0]
+    else:
+        data = args or kwargs
+
+    return current_app.response_class(
+        dumps(data),
+        mimetype=current_app.config['JSONIFY_MIMETYPE']
+    )
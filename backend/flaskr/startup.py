@@ -0,0 +1,103 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from models import (
+    database_path,
+    replica_path,
+    setup_db,
+    DB_CREATE_ALL,
+    Category
+)
+from .question_index import get_question_index
+from .search import get_memory_index
+
+WARM_CACHES_MODES = ('sync', 'background', 'off')
+
+
+@contextmanager
+def startup_phase(app, name):
+    """
+    startup_phase(app, name)
+        context timing a startup phase of the app, stored in seconds
+        in app.extensions['startup_timings'][name]
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        app.extensions['startup_timings'][name] = (
+            time.perf_counter() - start
+        )
+
+
+def init_database(app, database_path=database_path,
+                  replica_path=replica_path):
+    """
+    init_database(app, database_path, replica_path)
+        binds the app to its database and warms its caches as set by
+        LAZY_INIT and WARM_CACHES.
+        With LAZY_INIT nothing is sent to the database: the schema
+        is left to `flask init-db` and the first connection is made
+        by the first request.
+    """
+    lazy = app.config['LAZY_INIT']
+    with startup_phase(app, 'setup_db'):
+        setup_db(
+            app,
+            database_path,
+            replica_path,
+            create_all=DB_CREATE_ALL and not lazy
+        )
+
+    mode = app.config['WARM_CACHES'] or ('off' if lazy else 'sync')
+    if mode not in WARM_CACHES_MODES:
+        raise ValueError(
+            f'WARM_CACHES must be one of {", ".join(WARM_CACHES_MODES)}.'
+        )
+    if mode == 'sync':
+        warm_caches(app)
+    elif mode == 'background':
+        thread = threading.Thread(
+            target=warm_caches,
+            args=(app,),
+            name='warm-caches',
+            daemon=True
+        )
+        app.extensions['cache_warmer'] = thread
+        thread.start()
+
+
+def warm_caches(app):
+    """
+    warm_caches(app)
+        loads the category map and the in-memory indexes the app
+        uses, so the first requests do not pay for them
+    """
+    with startup_phase(app, 'warm_caches'), app.app_context():
+        Category.get_map()
+        if app.config['QUESTION_INDEX']:
+            get_question_index(app)
+        if app.config['SEARCH_BACKEND'] == 'memory':
+            get_memory_index(app)
+
+
+def init_startup_timings(app, started):
+    """
+    init_startup_timings(app, started)
+        logs the startup timings of the app at the end of
+        create_app, and stores as 'first_response' the time from
+        started (a time.perf_counter() value) to the end of the
+        first response
+    """
+    timings = app.extensions['startup_timings']
+    timings['create_app'] = time.perf_counter() - started
+    app.logger.info('startup: ' + ', '.join(
+        f'{name} {seconds * 1000:.1f} ms' for name, seconds in timings.items()
+    ))
+
+    @app.after_request
+    def record_first_response(response):
+        if 'first_response' not in timings:
+            timings['first_response'] = time.perf_counter() - started
+        return response
@@ -0,0 +1,82 @@
+from flask import current_app
+from sqlalchemy import func
+
+from models import (
+    db,
+    Question,
+    Category,
+    get_cache,
+    data_version,
+    use_primary
+)
+
+
+def question_counts():
+    """
+    question_counts()
+        returns the number of questions by (category, difficulty) as
+        a list of (category, difficulty, count) rows ordered by
+        category and difficulty, from one GROUP BY query.
+        The rows are read from the primary and cached in the cache
+        backend under the data version, so they are computed again
+        only after a question or category write.
+    """
+    key = f'question_counts:{data_version()}'
+    cache = get_cache()
+    counts = cache.get(key)
+    if counts is None:
+        # from the primary, the replica can lag behind the version
+        with use_primary():
+            counts = [
+                (category, difficulty, count)
+                for category, difficulty, count in db.session.query(
+                    Question.category,
+                    Question.difficulty,
+                    func.count()
+                ).group_by(Question.category, Question.difficulty).order_by(
+                    Question.category,
+                    Question.difficulty
+                )
+            ]
+        cache.set(key, counts, current_app.config['CACHE_TTL'])
+    return counts
+
+
+def question_stats():
+    """
+    question_stats()
+        returns the counts of question_counts() as a dict with the
+        keys 'totalQuestions', 'difficulties' ({difficulty: count})
+        and 'categories' ({id: {'type', 'totalQuestions',
+        'difficulties'}}, every category included).
+        Questions without a category or a difficulty only add to
+        the totals they belong to.
+    """
+    categories = {
+        str(id): {'type': type, 'totalQuestions': 0, 'difficulties': {}}
+        for id, type in Category.get_map().items()
+    }
+    difficulties = {}
+    total = 0
+
+    for category, difficulty, count in question_counts():
+        total += count
+        stats = categories.get(str(category))
+        if stats is not None:
+            stats['totalQuestions'] += count
+        if difficulty is None:
+            continue
+        difficulties[str(difficulty)] = (
+            difficulties.get(str(difficulty), 0) + count
+        )
+        if stats is not None:
+            stats['difficulties'][str(difficulty)] = count
+
+    return {
+        'totalQuestions': total,
+        'difficulties': dict(sorted(
+            difficulties.items(),
+            key=lambda item: int(item[0])
+        )),
+        'categories': categories
+    }
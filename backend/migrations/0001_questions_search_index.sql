@@ -0,0 +1,11 @@
+--
+-- Full-text search indexes used by POST /questions with a searchTerm
+--
+
+CREATE INDEX IF NOT EXISTS questions_question_search_idx
+    ON public.questions
+    USING gin (to_tsvector('simple'::regconfig, COALESCE(question, ''::text)));
+
+CREATE INDEX IF NOT EXISTS questions_question_answer_search_idx
+    ON public.questions
+    USING gin (to_tsvector('simple'::regconfig, ((COALESCE(question, ''::text) || ' '::text) || COALESCE(answer, ''::text))));
@@ -0,0 +1,14 @@
+--
+-- Indexes of the category filters, in id order: category listings
+-- and their cursor pages, quiz picks and counts, and the category
+-- and difficulty filters of exports and quizzes. Difficulty alone
+-- matches a fifth of the questions, a scan in id order is as good.
+--
+
+CREATE INDEX IF NOT EXISTS questions_category_id_idx
+    ON public.questions
+    USING btree (category, id);
+
+CREATE INDEX IF NOT EXISTS questions_category_difficulty_id_idx
+    ON public.questions
+    USING btree (category, difficulty, id);
@@ -1,29 +1,277 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import re
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from flask import has_request_context, request
+from sqlalchemy import (
+    Column,
+    Text,
+    Integer,
+    ForeignKey,
+    create_engine,
+    event,
+    func,
+    text,
+    any_,
+    bindparam,
+    ARRAY,
+    DDL
+)
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
-load_dotenv()
+from cache import LRUCache
+
+# deployments setting the environment themselves skip the .env lookup
+if os.environ.get('LOAD_DOTENV', '1') == '1':
+    load_dotenv()
 DB_NAME = os.environ.get('DB_NAME')
 DB_USER = os.environ.get('DB_USER')
 DB_PASSWORD = os.environ.get('DB_PASSWORD')
 DB_HOST = os.environ.get('DB_HOST')
 DB_PORT = os.environ.get('DB_PORT')
+DB_REPLICA_HOST = os.environ.get('DB_REPLICA_HOST')
+DB_REPLICA_PORT = os.environ.get('DB_REPLICA_PORT', DB_PORT)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 0))
+DB_CREATE_ALL = os.environ.get('DB_CREATE_ALL', '1') == '1'
+CATEGORY_CACHE_TTL = int(os.environ.get('CATEGORY_CACHE_TTL', 300))
+SEARCH_CONFIG = 'simple'
 database_path = f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+replica_path = None
+if DB_REPLICA_HOST:
+    replica_path = (
+        f'postgresql://{DB_USER}:{DB_PASSWORD}'
+        f'@{DB_REPLICA_HOST}:{DB_REPLICA_PORT}/{DB_NAME}'
+    )
+
+"""
+RoutingSession
+    session sending the statements of GET requests to the 'replica'
+    bind when one is configured, everything else to the primary.
+    Statements run inside use_primary() always go to the primary.
+"""
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        if (
+            has_request_context()
+            and request.method in ('GET', 'HEAD')
+            and not getattr(_routing, 'primary', False)
+            and 'replica' in (self.app.config.get('SQLALCHEMY_BINDS') or {})
+        ):
+            return self.app.extensions['sqlalchemy'].db.get_engine(
+                self.app,
+                bind='replica'
+            )
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+"""
+use_primary()
+    context sending the reads of the current thread to the primary,
+    even in a GET request. Caches keyed by the data version are
+    rebuilt inside it: read from a lagging replica, they would keep
+    the old data under the new version.
+"""
+_routing = threading.local()
+
+
+@contextmanager
+def use_primary():
+    previous = getattr(_routing, 'primary', False)
+    _routing.primary = True
+    try:
+        yield
+    finally:
+        _routing.primary = previous
+
+"""
+question_listeners
+    callables run as listener(action, question, versions) once the
+    insert, update or delete of a question is committed, action
+    being 'insert', 'update' or 'delete', question a QuestionRow of
+    the written values and versions the data versions (before,
+    after) the write.
+    Writes of many rows at once notify a single 'reload' with
+    question None, listeners then reload whatever they keep.
+"""
+question_listeners = []
+
+
+def notify_question_listeners(action, question):
+    notify_question_batch([(action, question)])
+
+
+def notify_question_batch(events):
+    """
+    notifies the (action, question) events of writes committed
+    together with a single data version change: the first event
+    gets (before, after), the next ones (after, after)
+    """
+    before, after = data_version(), bump_data_version()
+    for action, question in events:
+        for listener in question_listeners:
+            listener(action, question, (before, after))
+        before = after
+
+
+"""
+batched_writes()
+    context grouping the Question.insert(), update() and delete()
+    calls and the delete_questions() run inside it in one
+    transaction: they only flush, the transaction is committed once
+    on exit (rolled back on error) and the listeners are notified
+    after the commit. Nested contexts join the outer one.
+"""
+_batch = threading.local()
+
+
+@contextmanager
+def batched_writes():
+    if getattr(_batch, 'events', None) is not None:
+        yield
+        return
+
+    _batch.events = []
+    try:
+        yield
+        db.session.commit()
+        events = _batch.events
+    except BaseException:
+        db.session.rollback()
+        raise
+    finally:
+        _batch.events = None
+
+    if events:
+        notify_question_batch(events)
+
+
+def commit_question_writes(events):
+    """
+    commits the writes of the (action, question) events, unless
+    they are part of batched_writes() where they are only flushed.
+    Listeners get QuestionRow copies taken before the commit, which
+    expires the Question objects.
+    """
+    db.session.flush()
+    events = [(action, question_row(question)) for action, question in events]
+
+    if getattr(_batch, 'events', None) is None:
+        db.session.commit()
+        notify_question_batch(events)
+    else:
+        _batch.events.extend(events)
+
+
+"""
+get_cache() / set_cache(backend)
+    the cache backend (see cache.py) holding the category map, the
+    data version and the app caches. It is an in-process LRUCache
+    until create_app installs the one of its configuration, a
+    shared backend keeps every worker coherent.
+"""
+_cache = LRUCache()
+
+
+def get_cache():
+    return _cache
+
+
+def set_cache(backend):
+    global _cache
+    _cache = backend
+
+
+"""
+data_version()
+    token replaced after every committed question write and every
+    category change; caches put it in their keys so that any write
+    invalidates them, in every worker sharing the cache backend.
+    A missing token (never set or evicted) is replaced by a new one,
+    so the entries keyed with an older token are never read again.
+"""
+def data_version():
+    version = _cache.get('data_version')
+    if version is None:
+        version = os.urandom(8).hex()
+        if not _cache.add('data_version', version):
+            version = _cache.get('data_version') or version
+    return version
+
+
+def bump_data_version():
+    version = os.urandom(8).hex()
+    _cache.set('data_version', version)
+    return version
+
+"""
+engine_options(database_path)
+    pool and connection options of the engines, from the DB_POOL_*
+    and DB_STATEMENT_TIMEOUT (milliseconds, 0 for none) variables
+"""
+def engine_options(database_path):
+    # sqlite uses its own pools without these settings
+    if database_path.startswith('sqlite'):
+        return {}
+
+    options = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING
+    }
+    if DB_STATEMENT_TIMEOUT and database_path.startswith('postgresql'):
+        # cancels any statement running longer than the timeout
+        options['connect_args'] = {
+            'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT}'
+        }
+    return options
 
-db = SQLAlchemy()
 
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service.
+    Engine options and the read replica can be overridden in the app
+    config (SQLALCHEMY_ENGINE_OPTIONS, SQLALCHEMY_BINDS['replica']).
+    create_all=False skips the schema check for a faster start.
 """
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, replica_path=replica_path,
+             create_all=DB_CREATE_ALL):
     with app.app_context():
         app.config["SQLALCHEMY_DATABASE_URI"] = database_path
         app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+        app.config.setdefault(
+            "SQLALCHEMY_ENGINE_OPTIONS",
+            engine_options(database_path)
+        )
+        if replica_path:
+            app.config.setdefault(
+                "SQLALCHEMY_BINDS",
+                {"replica": replica_path}
+            )
         db.app = app
         db.init_app(app)
-        db.create_all()
+        if create_all:
+            # the replica only receives the schema of the primary
+            db.create_all(bind=None)
+            migrate(db.engine)
 
 """
 Question
@@ -33,9 +281,12 @@ class Question(db.Model):
     __tablename__ = 'questions'
 
     id = Column(Integer, primary_key=True)
-    question = Column(String)
-    answer = Column(String)
-    category = Column(String)
+    question = Column(Text)
+    answer = Column(Text)
+    category = Column(
+        Integer,
+        ForeignKey('categories.id', onupdate='CASCADE', ondelete='SET NULL')
+    )
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -46,14 +297,14 @@ class Question(db.Model):
 
     def insert(self):
         db.session.add(self)
-        db.session.commit()
+        commit_question_writes([('insert', self)])
 
     def update(self):
-        db.session.commit()
+        commit_question_writes([('update', self)])
 
     def delete(self):
         db.session.delete(self)
-        db.session.commit()
+        commit_question_writes([('delete', self)])
 
     def format(self):
         return {
@@ -64,6 +315,169 @@ class Question(db.Model):
             'difficulty': self.difficulty
             }
 
+"""
+question rows
+    read-only fast path: question_rows() reads QUESTION_FIELDS as
+    plain tuples and format_question_row() turns one into the dict
+    of Question.format(), without building Question objects.
+    Both take an optional subset of QUESTION_FIELDS to read and
+    format only those columns.
+"""
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+
+def question_rows(fields=QUESTION_FIELDS):
+    return db.session.query(*(getattr(Question, field) for field in fields))
+
+
+def format_question_row(row, fields=QUESTION_FIELDS):
+    return dict(zip(fields, row))
+
+
+# the values of a question, the fields after id default to None
+QuestionRow = namedtuple(
+    'QuestionRow',
+    QUESTION_FIELDS,
+    defaults=(None,) * (len(QUESTION_FIELDS) - 1)
+)
+
+
+def question_row(question):
+    if isinstance(question, QuestionRow):
+        return question
+    return QuestionRow(
+        *(getattr(question, field) for field in QUESTION_FIELDS)
+    )
+
+
+"""
+delete_questions(ids)
+    deletes the questions of ids with a single DELETE statement,
+    without loading them, and returns the ids that existed.
+    Committed right away unless inside batched_writes(); listeners
+    get a QuestionRow carrying only the id of each deleted question.
+"""
+
+
+def delete_questions(ids):
+    ids = list(ids)
+    if not ids:
+        return []
+
+    table = Question.__table__
+    if db.session.connection().dialect.name == 'postgresql':
+        # one array parameter whatever the number of ids
+        statement = table.delete().where(
+            table.c.id == any_(bindparam('ids', ids, type_=ARRAY(Integer)))
+        ).returning(table.c.id)
+        deleted = [row.id for row in db.session.execute(statement)]
+    else:
+        condition = table.c.id.in_(ids)
+        deleted = [
+            row.id for row in db.session.execute(
+                table.select().with_only_columns([table.c.id]).where(
+                    condition
+                )
+            )
+        ]
+        db.session.execute(table.delete().where(condition))
+
+    commit_question_writes([
+        ('delete', QuestionRow(id)) for id in deleted
+    ])
+    return deleted
+
+
+"""
+search_vector(include_answers)
+    the tsvector expression of a question, optionally with its answer.
+    It matches the GIN indexes created by the migrations/ files so
+    full-text searches never scan the questions table
+"""
+def search_vector(include_answers=False):
+    text = func.coalesce(Question.question, '')
+    if include_answers:
+        text = text + ' ' + func.coalesce(Question.answer, '')
+    return func.to_tsvector(SEARCH_CONFIG, text)
+
+
+"""
+migrations
+    versioned schema changes: the migrations/NNNN_name.sql files are
+    applied in the order of their number on PostgreSQL, each one in
+    its own transaction, and recorded in the schema_migrations table.
+    An advisory lock keeps concurrent workers from applying the same
+    migration twice.
+"""
+MIGRATIONS_PATH = os.path.join(os.path.dirname(__file__), 'migrations')
+MIGRATION_PATTERN = re.compile(r'(\d+)_\w+\.sql$')
+# pg_advisory_xact_lock key of the migrations
+MIGRATION_LOCK = 7415
+
+
+def list_migrations():
+    """
+    returns the (version, file name) of every migration, in order
+    """
+    migrations = []
+    for name in os.listdir(MIGRATIONS_PATH):
+        match = MIGRATION_PATTERN.match(name)
+        if match:
+            migrations.append((int(match.group(1)), name))
+    return sorted(migrations)
+
+
+def migrate(engine):
+    """
+    applies the migrations missing from the database of the engine,
+    returns the file names of the ones applied
+    """
+    if engine.dialect.name != 'postgresql':
+        return []
+
+    def applied_versions(connection):
+        connection.execute(
+            text('SELECT pg_advisory_xact_lock(:key)'),
+            key=MIGRATION_LOCK
+        )
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS schema_migrations ('
+            'version integer PRIMARY KEY, '
+            'name text NOT NULL, '
+            'applied_at timestamp with time zone NOT NULL DEFAULT now())'
+        )
+        return {
+            row.version for row in
+            connection.execute('SELECT version FROM schema_migrations')
+        }
+
+    with engine.begin() as connection:
+        applied = applied_versions(connection)
+    pending = [
+        (version, name) for version, name in list_migrations()
+        if version not in applied
+    ]
+
+    done = []
+    for version, name in pending:
+        with engine.begin() as connection:
+            # another worker may have applied it meanwhile
+            if version in applied_versions(connection):
+                continue
+            with open(os.path.join(MIGRATIONS_PATH, name)) as migration:
+                connection.execute(DDL(migration.read()))
+            connection.execute(
+                text(
+                    'INSERT INTO schema_migrations (version, name) '
+                    'VALUES (:version, :name)'
+                ),
+                version=version,
+                name=name
+            )
+        done.append(name)
+    return done
+
+
 """
 Category
 
@@ -72,13 +486,49 @@ class Category(db.Model):
     __tablename__ = 'categories'
 
     id = Column(Integer, primary_key=True)
-    type = Column(String)
+    type = Column(Text)
 
     def __init__(self, type):
         self.type = type
 
+    @classmethod
+    def get_map(cls):
+        """
+        returns the {id: type} map of all categories ordered by id.
+        The map is kept in the cache backend and reloaded after
+        CATEGORY_CACHE_TTL seconds or after invalidate_cache(),
+        callers must not modify it.
+        """
+        mapping = _cache.get('categories')
+        if mapping is None:
+            with use_primary():
+                categories = cls.query.order_by(cls.id).all()
+            mapping = {category.id: category.type for category in categories}
+            _cache.set('categories', mapping, CATEGORY_CACHE_TTL)
+        return mapping
+
+    @classmethod
+    def invalidate_cache(cls):
+        """
+        drops the cached map, the next get_map() reloads it
+        """
+        _cache.delete('categories')
+
     def format(self):
         return {
             'id': self.id,
             'type': self.type
             }
+
+
+"""
+invalidate_category_cache
+    drops the category map whenever a category row is written
+"""
+def invalidate_category_cache(mapper, connection, target):
+    Category.invalidate_cache()
+    bump_data_version()
+
+
+for _event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Category, _event, invalidate_category_cache)
@@ -1,9 +1,160 @@
+import asyncio
+import csv
+import gzip
 import os
 import unittest
 import json
+import pickle
+import socketserver
+import tempfile
+import threading
+import time
 from dotenv import load_dotenv
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from benchmark import SCENARIOS, build_requests, run_benchmark, compare
+from cache import RedisCache
 from flaskr import create_app
-from models import setup_db
+from flaskr.admission import TokenBuckets
+from flaskr.asgi import asyncpg, aiosqlite, create_asgi_app
+from flaskr.compression import brotli
+from flaskr.question_index import QuestionIndex, get_question_index
+from flaskr.quiz import (
+    QuizSessionStore,
+    nearest_difficulties,
+    quiz_difficulty
+)
+from flaskr.search import search_questions
+from flaskr.startup import init_database
+from models import (
+    setup_db,
+    db,
+    Category,
+    Question,
+    bump_data_version,
+    engine_options,
+    use_primary,
+    list_migrations,
+    migrate,
+    question_rows,
+    format_question_row
+)
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    """Local stand-in speaking the subset of Redis used by RedisCache"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeRedisHandler)
+        self.data = {}
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f'redis://127.0.0.1:{self.server_address[1]}/0'
+
+    def execute(self, command, *args):
+        with self.lock:
+            now = time.monotonic()
+            self.data = {
+                key: entry for key, entry in self.data.items()
+                if entry[0] is None or entry[0] > now
+            }
+            if command == b'GET':
+                entry = self.data.get(args[0])
+                return None if entry is None else entry[1]
+            if command == b'SET':
+                options = [arg.upper() for arg in args[2:]]
+                if b'NX' in options and args[0] in self.data:
+                    return None
+                expiry = None
+                if b'PX' in options:
+                    ttl = int(args[2 + options.index(b'PX') + 1])
+                    expiry = now + ttl / 1000
+                self.data[args[0]] = (expiry, args[1])
+                return 'OK'
+            if command == b'INCR':
+                expiry, value = self.data.get(args[0], (None, b'0'))
+                value = str(int(value) + 1).encode()
+                self.data[args[0]] = (expiry, value)
+                return int(value)
+            if command == b'PEXPIRE':
+                if args[0] not in self.data:
+                    return 0
+                expiry = now + int(args[1]) / 1000
+                self.data[args[0]] = (expiry, self.data[args[0]][1])
+                return 1
+            if command == b'DEL':
+                return sum(
+                    self.data.pop(key, None) is not None for key in args
+                )
+            if command == b'SCAN':
+                prefix = args[2].rstrip(b'*')
+                return [b'0', [
+                    key for key in self.data if key.startswith(prefix)
+                ]]
+            return Exception(f'unknown command {command}')
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            reply = self.server.execute(args[0].upper(), *args[1:])
+            self.wfile.write(self.encode(reply))
+
+    def encode(self, reply):
+        if reply is None:
+            return b'$-1\r\n'
+        if isinstance(reply, Exception):
+            return f'-ERR {reply}\r\n'.encode()
+        if isinstance(reply, str):
+            return f'+{reply}\r\n'.encode()
+        if isinstance(reply, int):
+            return f':{reply}\r\n'.encode()
+        if isinstance(reply, list):
+            return b'*%d\r\n' % len(reply) + b''.join(
+                self.encode(item) for item in reply
+            )
+        return b'$%d\r\n%s\r\n' % (len(reply), reply)
+
+
+async def asgi_request(app, method, path, body=None):
+    """Sends a request to an ASGI app, returns (status, decoded body)"""
+    path, _, query = path.partition('?')
+    headers = []
+    content = b''
+    if body is not None:
+        headers.append((b'content-type', b'application/json'))
+        content = json.dumps(body).encode()
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': query.encode(),
+        'headers': headers
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': content}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages[0]['status'], json.loads(messages[1]['body'])
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -37,6 +188,207 @@ class TriviaTestCase(unittest.TestCase):
     successful operation and for expected errors.
     """
 
+    '''
+    test database setup
+    '''
+
+    def test_engine_options(self):
+        options = engine_options(self.database_path)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertTrue(options['pool_size'] > 0)
+        self.assertEqual(engine_options('sqlite://'), {})
+
+        with self.app.app_context():
+            self.assertEqual(db.engine.pool.size(), options['pool_size'])
+
+    def test_replica_for_get_requests(self):
+        app = create_app(test_config={
+            'SQLALCHEMY_BINDS': {'replica': self.database_path}
+        })
+        setup_db(app, self.database_path)
+
+        with app.test_request_context('/questions', method='GET'):
+            replica = db.get_engine(app, bind='replica')
+            self.assertIs(db.session.get_bind(), replica)
+            db.session.remove()
+        with app.test_request_context('/questions', method='POST'):
+            self.assertIs(db.session.get_bind(), db.get_engine(app))
+            db.session.remove()
+
+        response = app.test_client().get('/questions')
+        self.assertEqual(response.status_code, 200)
+
+    def test_lagging_replica(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # the primary is a copy of the test database plus one
+            # question the replica (the test database) does not have
+            primary = f'sqlite:///{directory}/primary.db'
+            app = create_app(test_config=True)
+            setup_db(app, primary)
+            source = create_engine(self.database_path)
+            with source.connect() as connection, app.app_context():
+                for table in (Category.__table__, Question.__table__):
+                    rows = [
+                        dict(row) for row in connection.execute(
+                            table.select()
+                        )
+                    ]
+                    db.session.execute(table.insert(), rows)
+                db.session.commit()
+                question = Question('Replicated yet?', 'No', 1, 1)
+                question.insert()
+                question_id = question.id
+            source.dispose()
+
+            for config in ({}, {'RESPONSE_CACHE': False}):
+                app = create_app(test_config={
+                    'SQLALCHEMY_BINDS': {'replica': self.database_path},
+                    **config
+                })
+                setup_db(app, primary)
+                client = app.test_client()
+
+                # the version keyed caches are loaded from the primary
+                data = json.loads(client.get('/stats').data)
+                with app.app_context():
+                    total = Question.query.count()
+                self.assertEqual(data['totalQuestions'], total, config)
+                data = json.loads(
+                    client.get(f'/questions?after_id={question_id - 1}').data
+                )
+                self.assertEqual(data['totalQuestions'], total, config)
+                self.assertEqual(
+                    [question['id'] for question in data['questions']],
+                    [question_id],
+                    config
+                )
+
+                # other GET reads still go to the replica
+                with app.test_request_context('/questions', method='GET'):
+                    replica = db.get_engine(app, bind='replica')
+                    self.assertIs(db.session.get_bind(), replica)
+                    with use_primary():
+                        self.assertIs(
+                            db.session.get_bind(),
+                            db.get_engine(app)
+                        )
+                    db.session.remove()
+
+    def test_migrations(self):
+        with self.app.app_context():
+            # setup_db applied every migration
+            self.assertEqual(migrate(db.engine), [])
+            versions = [
+                row.version for row in db.session.execute(
+                    'SELECT version FROM schema_migrations ORDER BY version'
+                )
+            ]
+            self.assertEqual(
+                versions,
+                [version for version, _ in list_migrations()]
+            )
+
+        result = self.app.test_cli_runner().invoke(args=['migrate'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('0 migrations applied.', result.output)
+
+    def test_init_db_command(self):
+        result = self.app.test_cli_runner().invoke(args=['init-db'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Tables created, 0 migrations applied.', result.output)
+
+    '''
+    test startup
+    '''
+
+    def test_lazy_init(self):
+        statements = []
+
+        def count(*args):
+            statements.append(args[2])
+
+        event.listen(Engine, 'before_cursor_execute', count)
+        try:
+            app = create_app(test_config={'LAZY_INIT': True})
+            init_database(app, self.database_path)
+        finally:
+            event.remove(Engine, 'before_cursor_execute', count)
+
+        # nothing was sent to the database before the first request
+        self.assertEqual(statements, [])
+        self.assertNotIn('question_index', app.extensions)
+        timings = app.extensions['startup_timings']
+        self.assertIn('setup_db', timings)
+        self.assertNotIn('warm_caches', timings)
+
+        # time to first response of the fresh worker
+        response = app.test_client().get('/questions')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('question_index', app.extensions)
+        self.assertTrue(timings['first_response'] > timings['create_app'])
+
+    def test_warm_caches_background(self):
+        app = create_app(test_config={'WARM_CACHES': 'background'})
+        init_database(app, self.database_path)
+        app.extensions['cache_warmer'].join(10)
+
+        self.assertIn('question_index', app.extensions)
+        self.assertIn('warm_caches', app.extensions['startup_timings'])
+        response = app.test_client().get('/questions')
+        self.assertEqual(response.status_code, 200)
+
+    def test_warm_caches_invalid(self):
+        app = create_app(test_config={'WARM_CACHES': 'later'})
+        with self.assertRaises(ValueError):
+            init_database(app, self.database_path)
+
+    def explain(self, query):
+        # the test tables are tiny: give the planner their statistics
+        # and make it pick any usable index
+        statement = query.statement.compile(
+            dialect=db.engine.dialect,
+            compile_kwargs={'literal_binds': True}
+        )
+        db.session.execute('ANALYZE questions')
+        db.session.execute('SET LOCAL enable_seqscan = off')
+        plan = '\n'.join(
+            row[0] for row in db.session.execute(f'EXPLAIN {statement}')
+        )
+        db.session.rollback()
+        return plan
+
+    def test_category_queries_use_indexes(self):
+        with self.app.app_context():
+            by_category = question_rows().filter(Question.category == 4)
+
+            # category listing and its cursor pages
+            plan = self.explain(by_category.order_by(Question.id).limit(10))
+            self.assertIn('questions_category_id_idx', plan)
+            self.assertNotIn('Sort', plan)
+            plan = self.explain(
+                by_category.filter(Question.id > 5).order_by(Question.id)
+            )
+            self.assertIn('questions_category_id_idx', plan)
+
+            # quiz pick, without the previous questions
+            plan = self.explain(
+                by_category.filter(~Question.id.in_([5, 9])).order_by(
+                    Question.id
+                ).offset(1).limit(1)
+            )
+            self.assertIn('questions_category_id_idx', plan)
+
+            # category and difficulty filter
+            plan = self.explain(
+                by_category.filter(Question.difficulty == 2).order_by(
+                    Question.id
+                )
+            )
+            self.assertIn('questions_category_difficulty_id_idx', plan)
+
+            # the category is compared as an integer, without casts
+            self.assertNotIn('::text', plan)
+
     '''
     test /categories
     '''
@@ -56,6 +408,26 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['error'], 405)
         self.assertTrue(data['message'])
 
+    def test_get_categories_cache_invalidation(self):
+        # warm the cache
+        self.client().get('/categories')
+
+        with self.app.app_context():
+            category = Category(type='Cached')
+            db.session.add(category)
+            db.session.commit()
+            category_id = category.id
+
+        data = json.loads(self.client().get('/categories').data)
+        self.assertEqual(data['categories'][str(category_id)], 'Cached')
+
+        with self.app.app_context():
+            db.session.delete(Category.query.get(category_id))
+            db.session.commit()
+
+        data = json.loads(self.client().get('/categories').data)
+        self.assertNotIn(str(category_id), data['categories'])
+
     '''
     test /questions
     '''
@@ -73,6 +445,252 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['totalQuestions'])
         self.assertTrue(isinstance(data['totalQuestions'], int))
 
+    def test_get_questions_second_page(self):
+        first = json.loads(self.client().get('/questions?page=1').data)
+        response = self.client().get('/questions?page=2')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['totalQuestions'], first['totalQuestions'])
+        self.assertTrue(len(data['questions']) <= 10)
+        self.assertTrue(
+            data['questions'][0]['id'] > first['questions'][-1]['id']
+        )
+
+    def test_get_questions_cursor(self):
+        response = self.client().get('/questions?after_id=0&limit=5')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['questions']), 5)
+        self.assertEqual(data['next_cursor'], data['questions'][-1]['id'])
+        self.assertTrue(data['totalQuestions'])
+        self.assertTrue(data['currentCategory'])
+
+        # walk every page and compare with the total
+        seen = data['questions']
+        while data['next_cursor'] is not None:
+            data = json.loads(self.client().get(
+                f'/questions?after_id={data["next_cursor"]}&limit=5'
+            ).data)
+            seen += data['questions']
+        ids = [question['id'] for question in seen]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual(len(ids), data['totalQuestions'])
+
+    def test_get_questions_per_page(self):
+        first = json.loads(self.client().get('/questions').data)
+        data = json.loads(
+            self.client().get('/questions?per_page=4&page=2').data
+        )
+        self.assertEqual(len(data['questions']), 4)
+        self.assertEqual(data['questions'][0], first['questions'][4])
+        self.assertEqual(data['totalQuestions'], first['totalQuestions'])
+
+        # out of bounds sizes are clamped
+        data = json.loads(self.client().get('/questions?per_page=0').data)
+        self.assertEqual(len(data['questions']), 1)
+        data = json.loads(self.client().get('/questions?per_page=500').data)
+        self.assertEqual(
+            len(data['questions']),
+            min(data['totalQuestions'], 100)
+        )
+
+    def test_get_questions_fields(self):
+        full = json.loads(self.client().get('/questions').data)
+        response = self.client().get(
+            '/questions?fields=question,difficulty,unknown'
+        )
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['questions'], [
+            {
+                'id': question['id'],
+                'question': question['question'],
+                'difficulty': question['difficulty']
+            }
+            for question in full['questions']
+        ])
+
+        # also on the category listings and in cursor mode
+        data = json.loads(self.client().get(
+            '/categories/1/questions?fields=answer&after_id=0&limit=2'
+        ).data)
+        for question in data['questions']:
+            self.assertEqual(set(question), {'id', 'answer'})
+
+    def test_compression(self):
+        plain = self.client().get('/questions?per_page=20')
+        self.assertNotIn('Content-Encoding', plain.headers)
+
+        response = self.client().get(
+            '/questions?per_page=20',
+            headers={'Accept-Encoding': 'gzip'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertLess(len(response.data), len(plain.data))
+        self.assertEqual(gzip.decompress(response.data), plain.data)
+
+        # the weak ETag of the compressed body revalidates
+        response = self.client().get(
+            '/questions?per_page=20',
+            headers={
+                'Accept-Encoding': 'gzip',
+                'If-None-Match': response.headers['ETag']
+            }
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # small bodies and refused encodings are sent as they are
+        response = self.client().get(
+            '/categories',
+            headers={'Accept-Encoding': 'gzip'}
+        )
+        self.assertNotIn('Content-Encoding', response.headers)
+        response = self.client().get(
+            '/questions?per_page=20',
+            headers={'Accept-Encoding': 'gzip;q=0, identity'}
+        )
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    @unittest.skipUnless(brotli, 'brotli is not installed')
+    def test_compression_brotli(self):
+        plain = self.client().get('/questions?per_page=20')
+        response = self.client().get(
+            '/questions?per_page=20',
+            headers={'Accept-Encoding': 'gzip, br'}
+        )
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.data), plain.data)
+
+    def test_compression_disabled(self):
+        app = create_app(test_config={'COMPRESSION': False})
+        setup_db(app, self.database_path)
+        response = app.test_client().get(
+            '/questions?per_page=20',
+            headers={'Accept-Encoding': 'gzip'}
+        )
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    '''
+    test admission control
+    '''
+
+    def search(self, client, term='title'):
+        return client.post('/questions', json={'searchTerm': term})
+
+    def test_rate_limit(self):
+        app = create_app(test_config={'ADMISSION_LIMITS': 'search=1:2:0'})
+        setup_db(app, self.database_path)
+        client = app.test_client()
+
+        self.assertEqual(self.search(client).status_code, 200)
+        self.assertEqual(self.search(client).status_code, 200)
+        response = self.search(client)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['error'], 429)
+
+        # other clients and other routes are not limited
+        response = client.post(
+            '/questions',
+            json={'searchTerm': 'title'},
+            environ_base={'REMOTE_ADDR': '10.0.0.2'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(client.get('/questions').status_code, 200)
+
+    def test_concurrency_limit(self):
+        app = create_app(test_config={
+            'ADMISSION_LIMITS': 'quiz=0:0:1',
+            'ADMISSION_QUEUE_MS': 0
+        })
+        setup_db(app, self.database_path)
+        client = app.test_client()
+        body = {'previous_questions': [], 'quiz_category': {'id': 0}}
+
+        # a quiz request of another client holds the only slot
+        slot = app.extensions['admission'].admit('quiz', '10.0.0.2')
+        response = client.post('/quizzes', json=body)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(data['error'], 503)
+
+        # the slot is released at the end of every request
+        slot.release()
+        for _ in range(3):
+            self.assertEqual(
+                client.post('/quizzes', json=body).status_code,
+                200
+            )
+
+    def test_shared_rate_limit(self):
+        server = FakeRedisServer()
+        try:
+            config = {
+                'ADMISSION_LIMITS': 'search=0.01:2:0',
+                'RATE_LIMIT_URL': server.url
+            }
+            clients = []
+            for _ in range(2):
+                app = create_app(test_config=config)
+                setup_db(app, self.database_path)
+                clients.append(app.test_client())
+
+            # the two workers share the limit of the client
+            self.assertEqual(self.search(clients[0]).status_code, 200)
+            self.assertEqual(self.search(clients[1]).status_code, 200)
+            response = self.search(clients[0])
+            self.assertEqual(response.status_code, 429)
+            self.assertTrue(int(response.headers['Retry-After']) > 0)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_admission_control_disabled(self):
+        app = create_app(test_config={
+            'ADMISSION_CONTROL': False,
+            'ADMISSION_LIMITS': 'search=1:1:1'
+        })
+        setup_db(app, self.database_path)
+        client = app.test_client()
+        for _ in range(3):
+            self.assertEqual(self.search(client).status_code, 200)
+
+    def test_admission_limits_invalid(self):
+        for limits in ('export=1:1:1', 'search=1:1', 'search=-1:1:1'):
+            with self.assertRaises(ValueError):
+                create_app(test_config={'ADMISSION_LIMITS': limits})
+
+    def test_token_buckets(self):
+        buckets = TokenBuckets(rate=50, burst=2)
+        self.assertEqual(buckets.take('a'), 0)
+        self.assertEqual(buckets.take('a'), 0)
+        wait = buckets.take('a')
+        self.assertTrue(0 < wait <= 0.02)
+        self.assertEqual(buckets.take('b'), 0)
+        time.sleep(wait + 0.01)
+        self.assertEqual(buckets.take('a'), 0)
+
+    def test_question_rows_match_format(self):
+        with self.app.app_context():
+            questions = Question.query.order_by(Question.id).all()
+            rows = question_rows().order_by(Question.id).all()
+            self.assertEqual(
+                [format_question_row(row) for row in rows],
+                [question.format() for question in questions]
+            )
+
+    def test_get_questions_standard_json(self):
+        app = create_app(test_config={'FAST_JSON': False})
+        setup_db(app, self.database_path)
+        expected = json.loads(self.client().get('/questions').data)
+        data = json.loads(app.test_client().get('/questions').data)
+        self.assertEqual(data, expected)
+
     def test_get_questions_fail(self):
         response = self.client().patch('/questions')
         data = json.loads(response.data)
@@ -81,10 +699,289 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['error'], 405)
         self.assertTrue(data['message'])
 
+    def test_get_questions_etag(self):
+        response = self.client().get('/questions?page=2')
+        etag = response.headers['ETag']
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers['Cache-Control'])
+
+        response = self.client().get(
+            '/questions?page=2',
+            headers={'If-None-Match': etag}
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        # a new question changes the payload and the ETag
+        new_question = {
+            "question": "Is the ETag changed?",
+            "answer": "Yes",
+            "difficulty": 1,
+            "category": 1
+        }
+        res = self.client().post('/questions', json=new_question)
+        question_id = json.loads(res.data)['created']
+        response = self.client().get(
+            '/questions?page=2',
+            headers={'If-None-Match': etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.client().delete(f'/questions/{question_id}')
+
+    def test_redis_cache_backend(self):
+        server = FakeRedisServer()
+        try:
+            first = RedisCache(port=server.server_address[1], secret='test')
+            second = RedisCache(port=server.server_address[1], secret='test')
+
+            first.set('key', {'value': [1, 2]})
+            self.assertEqual(second.get('key'), {'value': [1, 2]})
+            self.assertFalse(second.add('key', 'other'))
+            self.assertTrue(second.add('new', 'value', ttl=0.05))
+            time.sleep(0.1)
+            self.assertIsNone(first.get('new'))
+
+            second.delete('key')
+            self.assertIsNone(first.get('key'))
+
+            first.set('a', 1)
+            first.set('b', 2)
+            second.clear()
+            self.assertIsNone(first.get('a'))
+            self.assertEqual(server.data, {})
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_redis_cache_signed_values(self):
+        server = FakeRedisServer()
+        try:
+            cache = RedisCache(port=server.server_address[1], secret='test')
+            other = RedisCache(port=server.server_address[1], secret='other')
+            cache.set('key', [1, 2])
+            self.assertEqual(cache.get('key'), [1, 2])
+
+            # values signed with another secret, or not at all, are
+            # misses and never unpickled
+            self.assertIsNone(other.get('key'))
+            server.data[b'trivia:key'] = (None, pickle.dumps([3]))
+            self.assertIsNone(cache.get('key'))
+
+            with self.assertRaises(ValueError):
+                RedisCache(port=server.server_address[1]).set('key', 1)
+            with self.assertRaises(ValueError):
+                create_app(test_config={'CACHE_URL': server.url})
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_redis_cache_unreachable(self):
+        server = FakeRedisServer()
+        url = server.url
+        server.shutdown()
+        server.server_close()
+
+        # every request falls back to the database
+        app = create_app(test_config={
+            'CACHE_URL': url,
+            'CACHE_SECRET': 'test'
+        })
+        setup_db(app, self.database_path)
+        with self.assertLogs('cache', level='WARNING'):
+            response = app.test_client().get('/questions')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(json.loads(response.data)['questions'])
+
+        # and so do writes, their version bump is only logged
+        with self.assertLogs('cache', level='WARNING') as logs:
+            response = app.test_client().post('/questions', json={
+                'question': 'Unreachable cache?',
+                'answer': 'Yes',
+                'category': 1,
+                'difficulty': 1
+            })
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(any('data_version' in line for line in logs.output))
+        app.test_client().delete(
+            f'/questions/{json.loads(response.data)["created"]}'
+        )
+
+    def test_shared_cache_invalidation(self):
+        server = FakeRedisServer()
+        try:
+            app = create_app(test_config={
+                'CACHE_URL': server.url,
+                'CACHE_SECRET': 'test'
+            })
+            setup_db(app, self.database_path)
+            client = app.test_client
+
+            response = client().get('/questions')
+            total = json.loads(response.data)['totalQuestions']
+            etag = response.headers['ETag']
+            self.assertTrue(any(
+                key.startswith(b'trivia:response:') for key in server.data
+            ))
+
+            # another worker commits a question and bumps the version
+            worker = RedisCache(port=server.server_address[1], secret='test')
+            with app.app_context():
+                question = Question('Shared?', 'Yes', 1, 1)
+                db.session.add(question)
+                db.session.commit()
+                question_id = question.id
+            worker.set('data_version', 'from-another-worker')
+
+            response = client().get(
+                '/questions',
+                headers={'If-None-Match': etag}
+            )
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            self.assertEqual(data['totalQuestions'], total + 1)
+
+            with app.app_context():
+                db.session.delete(Question.query.get(question_id))
+                db.session.commit()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_shared_memory_search_invalidation(self):
+        server = FakeRedisServer()
+        try:
+            config = {
+                'CACHE_URL': server.url,
+                'CACHE_SECRET': 'test',
+                'SEARCH_BACKEND': 'memory'
+            }
+            clients = []
+            for _ in range(2):
+                app = create_app(test_config=config)
+                setup_db(app, self.database_path)
+                clients.append(app.test_client())
+            writer, reader = clients
+
+            def search(client):
+                response = client.post(
+                    '/questions',
+                    json={'searchTerm': 'Zanzibar quokka'}
+                )
+                return json.loads(response.data)['totalQuestions']
+
+            # both workers load their memory index
+            self.assertEqual(search(writer), 0)
+            self.assertEqual(search(reader), 0)
+
+            # a question written by one worker is found by the other
+            response = writer.post('/questions', json={
+                'question': 'Where does the Zanzibar quokka live?',
+                'answer': 'Nowhere',
+                'category': 1,
+                'difficulty': 1
+            })
+            question_id = json.loads(response.data)['created']
+            self.assertEqual(search(writer), 1)
+            self.assertEqual(search(reader), 1)
+
+            # and so is its delete
+            writer.delete(f'/questions/{question_id}')
+            self.assertEqual(search(writer), 0)
+            self.assertEqual(search(reader), 0)
+        finally:
+            server.shutdown()
+            server.server_close()
+
     '''
     test /categories/1/questions
     '''
 
+    '''
+    test /bootstrap
+    '''
+
+    def test_get_bootstrap(self):
+        response = self.client().get('/bootstrap')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+
+        # same categories and first page as GET /questions
+        questions = json.loads(self.client().get('/questions').data)
+        for key in ('questions', 'totalQuestions', 'categories',
+                    'currentCategory'):
+            self.assertEqual(data[key], questions[key])
+
+        # one count per category, matching the category listings
+        self.assertEqual(set(data['categoryCounts']), set(data['categories']))
+        for key, count in data['categoryCounts'].items():
+            listing = json.loads(
+                self.client().get(f'/categories/{key}/questions').data
+            )
+            self.assertEqual(count, listing.get('totalQuestions', 0))
+
+    def test_get_bootstrap_without_index(self):
+        app = create_app(test_config={'QUESTION_INDEX': False})
+        setup_db(app, self.database_path)
+        expected = json.loads(self.client().get('/bootstrap').data)
+        data = json.loads(app.test_client().get('/bootstrap').data)
+        self.assertEqual(data, expected)
+
+    def test_get_bootstrap_fail(self):
+        response = self.client().post('/bootstrap')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(data['success'], False)
+
+    '''
+    test /stats
+    '''
+
+    def test_get_stats(self):
+        response = self.client().get('/stats')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+
+        with self.app.app_context():
+            questions = Question.query.all()
+        self.assertEqual(data['totalQuestions'], len(questions))
+        for key, stats in data['categories'].items():
+            difficulties = {}
+            for question in questions:
+                if question.category == int(key):
+                    difficulty = str(question.difficulty)
+                    difficulties[difficulty] = (
+                        difficulties.get(difficulty, 0) + 1
+                    )
+            self.assertEqual(stats['difficulties'], difficulties)
+            self.assertEqual(
+                stats['totalQuestions'],
+                sum(difficulties.values())
+            )
+        self.assertEqual(
+            sum(data['difficulties'].values()),
+            len(questions)
+        )
+
+    def test_get_stats_invalidation(self):
+        before = json.loads(self.client().get('/stats').data)
+
+        with self.app.app_context():
+            question = Question('Stats?', 'Yes', 1, 5)
+            question.insert()
+            question_id = question.id
+
+        data = json.loads(self.client().get('/stats').data)
+        self.assertEqual(data['totalQuestions'], before['totalQuestions'] + 1)
+        self.assertEqual(
+            data['categories']['1']['difficulties'].get('5', 0),
+            before['categories']['1']['difficulties'].get('5', 0) + 1
+        )
+
+        self.client().delete(f'/questions/{question_id}')
+        data = json.loads(self.client().get('/stats').data)
+        self.assertEqual(data, before)
+
     def test_get_questions_by_category_success(self):
         response = self.client().get('/categories/1/questions')
         data = json.loads(response.data)
@@ -96,6 +993,123 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['totalQuestions'])
         self.assertTrue(isinstance(data['totalQuestions'], int))
 
+    def test_get_questions_by_category_cursor(self):
+        response = self.client().get(
+            '/categories/1/questions?after_id=0&limit=1'
+        )
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['questions']), 1)
+        self.assertEqual(data['questions'][0]['category'], 1)
+        self.assertEqual(data['next_cursor'], data['questions'][0]['id'])
+
+    def test_get_questions_by_category_without_index(self):
+        app = create_app(test_config={'QUESTION_INDEX': False})
+        setup_db(app, self.database_path)
+        for path in ('/questions', '/categories/4/questions?page=1',
+                     '/categories/1/questions?after_id=0&limit=2'):
+            expected = json.loads(self.client().get(path).data)
+            data = json.loads(app.test_client().get(path).data)
+            self.assertEqual(data, expected)
+
+    def test_question_index(self):
+        index = QuestionIndex()
+        index.build([(1, 1, 2), (2, 2, 2), (3, 1, 5), (5, 1, None)])
+        self.assertEqual(list(index.ids()), [1, 2, 3, 5])
+        self.assertEqual(list(index.ids(1)), [1, 3, 5])
+        self.assertEqual(list(index.ids(1, 5)), [3])
+        self.assertEqual(index.difficulties(), {2: 2, 5: 1})
+
+        index.add(4, 2, 5)
+        index.add(3, 2, 1)
+        index.remove(1)
+        self.assertEqual(list(index.ids()), [2, 3, 4, 5])
+        self.assertEqual(list(index.ids(1)), [5])
+        self.assertEqual(list(index.ids(2)), [2, 3, 4])
+        self.assertEqual(index.count(2, 5), 1)
+        self.assertNotIn(1, index)
+        self.assertIn(4, index)
+
+        self.assertEqual(index.random_id(2, exclude={2, 3}), 4)
+        self.assertIsNone(index.random_id(2, exclude={2, 3, 4}))
+        self.assertIsNone(index.random_id(6))
+
+    def test_question_index_follows_writes(self):
+        with self.app.app_context():
+            index = get_question_index(self.app)
+            total = index.count()
+            question = Question('Indexed?', 'Yes', 3, 2)
+            question.insert()
+
+            # updated in place by this worker's write
+            self.assertIs(get_question_index(self.app), index)
+            self.assertEqual(index.count(), total + 1)
+            self.assertEqual(index.ids(3)[-1], question.id)
+            self.assertIn(question.id, index.ids(3, 2))
+
+            # rebuilt after a write of another worker
+            bump_data_version()
+            self.assertIsNot(get_question_index(self.app), index)
+
+            question.delete()
+            self.assertEqual(get_question_index(self.app).count(), total)
+
+    def test_question_index_ttl(self):
+        with self.app.app_context():
+            index = get_question_index(self.app)
+            total = index.count()
+
+            # a worker with its own cache backend commits a question,
+            # the data version seen here does not change
+            question = Question('Elsewhere?', 'Yes', 3, 2)
+            db.session.add(question)
+            db.session.commit()
+            self.assertIs(get_question_index(self.app), index)
+
+            # rebuilt once CACHE_TTL seconds have passed
+            index.loaded -= self.app.config['CACHE_TTL']
+            self.assertEqual(get_question_index(self.app).count(), total + 1)
+
+            db.session.delete(question)
+            db.session.commit()
+
+    def test_question_index_single_rebuild(self):
+        with self.app.app_context():
+            index = get_question_index(self.app)
+            lock = self.app.extensions['index_locks']['question_index']
+
+            # while another thread rebuilds, the previous index is
+            # served without waiting
+            bump_data_version()
+            lock.acquire()
+            try:
+                self.assertIs(get_question_index(self.app), index)
+            finally:
+                lock.release()
+            rebuilt = get_question_index(self.app)
+            self.assertIsNot(rebuilt, index)
+            self.assertEqual(rebuilt.count(), index.count())
+
+            # without a previous index, every thread waits for the
+            # first one to build it
+            del self.app.extensions['question_index']
+            indexes = []
+            threads = [
+                threading.Thread(target=lambda: indexes.append(
+                    get_question_index(self.app)
+                ))
+                for _ in range(4)
+            ]
+            with lock:
+                for thread in threads:
+                    thread.start()
+                time.sleep(0.05)
+                self.assertEqual(indexes, [])
+            for thread in threads:
+                thread.join(10)
+            self.assertEqual(len(indexes), 4)
+            self.assertEqual(len(set(map(id, indexes))), 1)
+
     def test_get_questions_by_category_fail(self):
         response = self.client().get('/categories/a/questions')
         data = json.loads(response.data)
@@ -129,6 +1143,203 @@ class TriviaTestCase(unittest.TestCase):
         res = self.client().post('/questions', json=new_question)
         self.assertEqual(res.status_code, 500)
 
+    def test_post_questions_wrong_category(self):
+        new_question = {
+            "question": "Is this test working?",
+            "answer": "Yes",
+            "difficulty": 5,
+            "category": 1000
+        }
+        res = self.client().post('/questions', json=new_question)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_post_questions_string_difficulty(self):
+        # the form posts the difficulty of its <select> as a string
+        with self.app.app_context():
+            get_question_index(self.app)
+        new_question = {
+            "question": "Is the difficulty a number?",
+            "answer": "Yes",
+            "difficulty": "3",
+            "category": "2"
+        }
+        res = self.client().post('/questions', json=new_question)
+        self.assertEqual(res.status_code, 201)
+        question_id = json.loads(res.data)['created']
+
+        with self.app.app_context():
+            self.assertEqual(Question.query.get(question_id).difficulty, 3)
+            self.assertIn(question_id, get_question_index(self.app).ids(2, 3))
+        body = {
+            "quiz_category": {"id": 2},
+            "previous_questions": [],
+            "difficulty": 2
+        }
+        res = self.client().post('/quizzes', json=body)
+        self.assertEqual(res.status_code, 200)
+        self.client().delete(f'/questions/{question_id}')
+
+        new_question['difficulty'] = 'hard'
+        res = self.client().post('/questions', json=new_question)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_question_index_string_difficulty(self):
+        index = QuestionIndex()
+        index.build([(1, 1, '2')])
+        index.add(2, 1, '3')
+        self.assertEqual(index.difficulties(1), {2: 1, 3: 1})
+
+    '''
+    test POST /questions/bulk
+    '''
+
+    def test_bulk_import_jsonl(self):
+        lines = [
+            {"question": "Bulk one?", "answer": "1", "category": 1,
+             "difficulty": 2},
+            {"question": "Bulk two?", "answer": "2", "category": 1000},
+            "not json",
+            {"question": "Bulk three?", "answer": "3", "category": "2"}
+        ]
+        body = '\n'.join(
+            line if isinstance(line, str) else json.dumps(line)
+            for line in lines
+        )
+        res = self.client().post(
+            '/questions/bulk?batch_size=1',
+            data=body,
+            content_type='application/x-ndjson'
+        )
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['imported'], 2)
+        self.assertEqual(data['failed'], 2)
+        self.assertEqual([error['row'] for error in data['errors']], [2, 3])
+
+        with self.app.app_context():
+            imported = Question.query.filter(
+                Question.question.like('Bulk %')
+            ).order_by(Question.id).all()
+            self.assertEqual(
+                [question.answer for question in imported],
+                ['1', '3']
+            )
+            for question in imported:
+                db.session.delete(question)
+            db.session.commit()
+
+    def test_bulk_import_csv(self):
+        body = (
+            'question,answer,category,difficulty\n'
+            '"Bulk, CSV?","Yes",3,4\n'
+            'Bulk CSV without answer?,,3,1\n'
+        )
+        res = self.client().post(
+            '/questions/bulk',
+            data=body,
+            content_type='text/csv'
+        )
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['imported'], 1)
+        self.assertEqual(data['errors'][0]['row'], 2)
+
+        with self.app.app_context():
+            question = Question.query.filter_by(question='Bulk, CSV?').one()
+            self.assertEqual(question.difficulty, 4)
+            question.delete()
+
+    def test_bulk_import_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as source:
+            source.write('question,answer,category\nBulk CLI?,Yes,5\n')
+            source.flush()
+            result = self.app.test_cli_runner().invoke(
+                args=['import-questions', source.name]
+            )
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('1 questions imported, 0 rows failed.', result.output)
+
+        with self.app.app_context():
+            Question.query.filter_by(question='Bulk CLI?').one().delete()
+
+    def test_bulk_import_invalid_text(self):
+        before = json.loads(self.client().get('/stats').data)
+        body = (
+            '{"question": "Bulk valid?", "answer": "1", "category": 1}\n'
+            '{"question": "Bulk valid too?", "answer": "2", "category": 1}\n'
+        ).encode() + b'{"question": "Bulk \xff?"}\n'
+        res = self.client().post(
+            '/questions/bulk?batch_size=1',
+            data=body,
+            content_type='application/x-ndjson'
+        )
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertIn('not UTF-8', data['message'])
+        self.assertEqual(data['imported'], 2)
+
+        # the caches saw the committed rows
+        stats = json.loads(self.client().get('/stats').data)
+        self.assertEqual(
+            stats['totalQuestions'],
+            before['totalQuestions'] + 2
+        )
+
+        with self.app.app_context():
+            for question in Question.query.filter(
+                Question.question.like('Bulk valid%')
+            ):
+                db.session.delete(question)
+            db.session.commit()
+
+    def test_bulk_import_fail(self):
+        res = self.client().post('/questions/bulk?format=xml', data='<a/>')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    '''
+    test GET /questions/export
+    '''
+
+    def test_export_questions_jsonl(self):
+        res = self.client().get('/questions/export')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line) for line in res.data.splitlines()]
+        total = json.loads(self.client().get('/questions').data)[
+            'totalQuestions'
+        ]
+        self.assertEqual(len(rows), total)
+        ids = [row['id'] for row in rows]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(
+            set(rows[0]),
+            {'id', 'question', 'answer', 'category', 'difficulty'}
+        )
+
+    def test_export_questions_csv_filtered(self):
+        res = self.client().get(
+            '/questions/export?format=csv&category=2&difficulty=4'
+        )
+        self.assertEqual(res.status_code, 200)
+        rows = list(csv.DictReader(res.data.decode().splitlines()))
+        self.assertTrue(rows)
+        for row in rows:
+            self.assertEqual(row['category'], '2')
+            self.assertEqual(row['difficulty'], '4')
+
+    def test_export_questions_fail(self):
+        res = self.client().get('/questions/export?format=xml')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     '''
     test POST /questions (search)
     '''
@@ -147,6 +1358,90 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['totalQuestions'])
         self.assertTrue(isinstance(data['totalQuestions'], int))
 
+    def test_search_questions_cursor(self):
+        search_query = {
+            "searchTerm": "the"
+        }
+        res = self.client().post(
+            '/questions?after_id=0&limit=2', json=search_query
+        )
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['questions']), 2)
+        self.assertTrue(data['totalQuestions'] > 2)
+        self.assertEqual(data['next_cursor'], data['questions'][-1]['id'])
+
+    def test_search_questions_answers(self):
+        search_query = {
+            "searchTerm": "scarab"
+        }
+        res = self.client().post('/questions', json=search_query)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['totalQuestions'], 0)
+
+        search_query['searchAnswers'] = True
+        res = self.client().post('/questions', json=search_query)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['totalQuestions'], 1)
+        self.assertEqual(data['questions'][0]['answer'], 'Scarab')
+
+    def test_search_questions_uses_index(self):
+        with self.app.app_context():
+            query = search_questions('medic', search_answers=True)
+            sql = str(query.statement.compile(
+                dialect=db.engine.dialect,
+                compile_kwargs={'literal_binds': True}
+            ))
+            db.session.execute('SET LOCAL enable_seqscan = off')
+            plan = ' '.join(
+                row[0] for row in db.session.execute('EXPLAIN ' + sql)
+            )
+            db.session.rollback()
+        self.assertIn('questions_question_answer_search_idx', plan)
+
+    def test_search_questions_memory_backend(self):
+        app = create_app(test_config={'SEARCH_BACKEND': 'memory'})
+        setup_db(app, self.database_path)
+        client = app.test_client
+
+        search_query = {
+            "searchTerm": "medic"
+        }
+        res = client().post('/questions', json=search_query)
+        data = json.loads(res.data)
+        expected = json.loads(
+            self.client().post('/questions', json=search_query).data
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['totalQuestions'], expected['totalQuestions'])
+        self.assertEqual(data['questions'], expected['questions'])
+        self.assertTrue(data['currentCategory'])
+
+        # inserted and deleted questions update the index
+        new_question = {
+            "question": "Which memory index answers this?",
+            "answer": "The inverted one",
+            "difficulty": 1,
+            "category": 1
+        }
+        res = client().post('/questions', json=new_question)
+        question_id = json.loads(res.data)['created']
+        search_query = {
+            "searchTerm": "MEMORY ind",
+            "searchAnswers": True
+        }
+        data = json.loads(client().post('/questions', json=search_query).data)
+        self.assertEqual(
+            [question['id'] for question in data['questions']],
+            [question_id]
+        )
+
+        client().delete(f'/questions/{question_id}')
+        data = json.loads(client().post('/questions', json=search_query).data)
+        self.assertEqual(data['totalQuestions'], 0)
+
     def test_search_questions_fail(self):
         search_query = {
             "search": "medic"
@@ -182,6 +1477,77 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['error'], 404)
         self.assertTrue(data['message'])
 
+    def test_delete_questions_missing(self):
+        response = self.client().delete('/questions/100000')
+        data = json.loads(response.data)
+        self.assertEqual(data['success'], False)
+
+    '''
+    test POST /questions/batch
+    '''
+
+    def test_batch_questions(self):
+        with self.app.app_context():
+            index = get_question_index(self.app)
+            total = index.count()
+
+        body = {'operations': [
+            {'op': 'insert', 'question': 'Batched?', 'answer': 'Yes',
+             'category': 2, 'difficulty': 3},
+            {'op': 'insert', 'question': 'Batched too?', 'answer': 'Yes',
+             'category': 2},
+            {'op': 'delete', 'id': 100000}
+        ]}
+        res = self.client().post('/questions/batch', json=body)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual(data['deleted'], 0)
+        first, second = data['results'][0]['id'], data['results'][1]['id']
+        self.assertEqual(second, first + 1)
+        self.assertEqual(
+            data['results'][2],
+            {'op': 'delete', 'id': 100000, 'deleted': False}
+        )
+
+        # the index followed the committed batch in place
+        with self.app.app_context():
+            self.assertIs(get_question_index(self.app), index)
+            self.assertEqual(index.count(), total + 2)
+            self.assertIn(first, index.ids(2, 3))
+
+        body = {'operations': [
+            {'op': 'delete', 'id': first},
+            {'op': 'delete', 'id': second}
+        ]}
+        res = self.client().post('/questions/batch', json=body)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['deleted'], 2)
+        with self.app.app_context():
+            self.assertEqual(get_question_index(self.app).count(), total)
+            self.assertIsNone(Question.query.get(first))
+
+    def test_batch_questions_fail(self):
+        with self.app.app_context():
+            total = Question.query.count()
+
+        # nothing is written when an operation is invalid
+        body = {'operations': [
+            {'op': 'insert', 'question': 'Batched?', 'answer': 'Yes',
+             'category': 2},
+            {'op': 'insert', 'question': 'Batched?', 'category': 2}
+        ]}
+        res = self.client().post('/questions/batch', json=body)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('Operation 1', data['message'])
+        with self.app.app_context():
+            self.assertEqual(Question.query.count(), total)
+
+        res = self.client().post('/questions/batch', json={'operations': []})
+        self.assertEqual(res.status_code, 400)
+
     '''
     test POST /quizzes
     '''
@@ -200,6 +1566,83 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['question'])
         self.assertTrue(isinstance(data['question'], object))
 
+    def test_quizzes_skips_previous_questions(self):
+        body = {
+            "quiz_category": {
+                "id": 4,
+                "type": "History"
+            },
+            "previous_questions": []
+        }
+        played = []
+        while True:
+            res = self.client().post('/quizzes', json=body)
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            if data['question'] is None:
+                break
+            self.assertEqual(data['question']['category'], 4)
+            self.assertNotIn(data['question']['id'], played)
+            played.append(data['question']['id'])
+            body['previous_questions'] = played
+        self.assertTrue(played)
+
+    def play_adaptive_quiz(self, client, difficulty):
+        body = {
+            "quiz_category": {"id": 0},
+            "previous_questions": [],
+            "difficulty": difficulty
+        }
+        played = []
+        last_distance = 0
+        while True:
+            res = client.post('/quizzes', json=body)
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            if data['question'] is None:
+                return played
+            self.assertNotIn(data['question']['id'], played)
+            played.append(data['question']['id'])
+            body['previous_questions'] = played
+            # every question of a difficulty comes before the farther
+            # ones
+            distance = abs(data['question']['difficulty'] - difficulty)
+            self.assertGreaterEqual(distance, last_distance)
+            last_distance = distance
+
+    def test_quizzes_difficulty(self):
+        with self.app.app_context():
+            total = Question.query.count()
+        self.assertEqual(len(self.play_adaptive_quiz(self.client(), 4)),
+                         total)
+
+        app = create_app(test_config={'QUESTION_INDEX': False})
+        setup_db(app, self.database_path)
+        self.assertEqual(
+            len(self.play_adaptive_quiz(app.test_client(), 2)),
+            total
+        )
+
+    def test_quizzes_ramp(self):
+        self.assertEqual(quiz_difficulty(), 1)
+        self.assertEqual(quiz_difficulty(2, None, 10), 2)
+        self.assertEqual(quiz_difficulty(None, 3, 7), 3)
+        self.assertEqual(nearest_difficulties(3, [1, 2, 4, 5]), [2, 4, 1, 5])
+
+        body = {
+            "quiz_category": {"id": 0},
+            "previous_questions": [],
+            "ramp": 1
+        }
+        res = self.client().post('/quizzes', json=body)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['difficulty'], 1)
+
+        body['difficulty'] = 'hard'
+        res = self.client().post('/quizzes', json=body)
+        self.assertEqual(res.status_code, 400)
+
     def test_quizzes_fail(self):
         body = {
             "previous_questions": []
@@ -207,6 +1650,300 @@ class TriviaTestCase(unittest.TestCase):
         res = self.client().post('/quizzes', json=body)
         self.assertEqual(res.status_code, 400)
 
+    '''
+    test /quizzes/sessions
+    '''
+
+    def test_quiz_session_success(self):
+        body = {
+            "quiz_category": {
+                "id": 4,
+                "type": "History"
+            }
+        }
+        res = self.client().post('/quizzes/sessions', json=body)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 201)
+        session_id = data['session_id']
+        total = data['totalQuestions']
+        self.assertTrue(total)
+
+        played = []
+        while True:
+            res = self.client().post(f'/quizzes/sessions/{session_id}/next')
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            if data['question'] is None:
+                break
+            self.assertEqual(data['question']['category'], 4)
+            played.append(data['question']['id'])
+            self.assertEqual(data['remaining'], total - len(played))
+        self.assertEqual(len(played), total)
+        self.assertEqual(len(set(played)), total)
+
+        res = self.client().delete(f'/quizzes/sessions/{session_id}')
+        self.assertEqual(res.status_code, 200)
+
+    def test_quiz_session_fail(self):
+        res = self.client().post('/quizzes/sessions', json={})
+        self.assertEqual(res.status_code, 400)
+
+        res = self.client().post('/quizzes/sessions/unknown/next')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+    def test_quiz_session_store_expiry(self):
+        store = QuizSessionStore(ttl=0.05, max_sessions=2)
+        first = store.create([1, 2])
+        self.assertIn(store.next(first)[0], (1, 2))
+
+        # the least recently used session is dropped beyond the maximum
+        second = store.create([3])
+        store.next(first)
+        store.create([4])
+        self.assertRaises(KeyError, store.next, second)
+        self.assertEqual(store.next(first), (None, 0))
+
+        time.sleep(0.1)
+        self.assertRaises(KeyError, store.next, first)
+        self.assertEqual(len(store), 0)
+
+    '''
+    test /metrics
+    '''
+
+    def test_metrics(self):
+        app = create_app(test_config={
+            'RESPONSE_CACHE': False,
+            'SLOW_REQUEST_MS': 0.001
+        })
+        setup_db(app, self.database_path)
+        client = app.test_client()
+
+        with self.assertLogs(app.logger, 'WARNING') as logs:
+            self.assertEqual(client.get('/questions?page=2').status_code, 200)
+        self.assertIn(
+            'slow request: GET /questions?page=2 200',
+            logs.output[0]
+        )
+
+        response = client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        text = response.get_data(as_text=True)
+        labels = 'method="GET",route="/questions"'
+        self.assertIn(
+            f'trivia_requests_total{{{labels},status="200"}} 1', text
+        )
+        self.assertIn(f'trivia_request_duration_seconds_count{{{labels}}} 1',
+                      text)
+        self.assertIn(f'trivia_slow_requests_total{{{labels}}} 1', text)
+
+        # at least the statement loading the page and its 10 rows
+        samples = dict(
+            line.rsplit(' ', 1) for line in text.splitlines()
+            if not line.startswith('#')
+        )
+        self.assertGreaterEqual(
+            float(samples[f'trivia_request_queries_sum{{{labels}}}']), 1
+        )
+        self.assertGreaterEqual(
+            float(samples[f'trivia_request_rows_sum{{{labels}}}']), 10
+        )
+        self.assertGreater(
+            float(samples[f'trivia_response_bytes_sum{{{labels}}}']), 0
+        )
+
+    def test_metrics_disabled(self):
+        app = create_app(test_config={'METRICS': False})
+        setup_db(app, self.database_path)
+        self.assertEqual(app.test_client().get('/metrics').status_code, 404)
+
+    '''
+    test benchmark.py
+    '''
+
+    def test_benchmark(self):
+        results = run_benchmark(self.app, requests=5, concurrency=2,
+                                warmup=1)
+        for mode in ('client', 'http'):
+            self.assertEqual(set(results[mode]), set(SCENARIOS))
+            for result in results[mode].values():
+                self.assertEqual(result['errors'], 0)
+                self.assertTrue(result['p99_ms'] >= result['p50_ms'] > 0)
+                self.assertTrue(result['throughput'] > 0)
+        self.assertTrue(results['peak_rss_mb'] > 0)
+        self.assertEqual(results['client']['quiz']['queries_per_request'], 1)
+
+        self.assertEqual(compare(results, results), [])
+        baseline = json.loads(json.dumps(results))
+        baseline['http']['search']['queries_per_request'] -= 1
+        baseline['client']['quiz']['p99_ms'] /= 2
+        self.assertEqual(len(compare(results, baseline, tolerance=0.5)), 2)
+
+    def test_benchmark_quiz_ids(self):
+        with self.app.app_context():
+            ids = {id for id, in db.session.query(Question.id)}
+        for _, _, body in build_requests(self.app, 'quiz', 20):
+            self.assertTrue(set(body['previous_questions']) <= ids)
+
+    '''
+    test the ASGI app
+    '''
+
+    def compare_asgi(self, app, client, requests):
+        async def run():
+            for method, path, body in requests:
+                response = client.open(path, method=method, json=body)
+                status, data = await asgi_request(app, method, path, body)
+                self.assertEqual(
+                    (status, data),
+                    (response.status_code, json.loads(response.data)),
+                    path
+                )
+            await app.database.close()
+
+        asyncio.run(run())
+
+    @unittest.skipUnless(asyncpg, 'asyncpg is not installed')
+    def test_asgi_same_responses(self):
+        self.compare_asgi(create_asgi_app(self.database_path), self.client(), [
+            ('GET', '/categories', None),
+            ('GET', '/questions', None),
+            ('GET', '/questions?page=2', None),
+            ('GET', '/questions?page=1000', None),
+            ('GET', '/questions?after_id=5&limit=3', None),
+            ('GET', '/questions?per_page=3&page=2', None),
+            ('GET', '/questions?fields=question,category&per_page=50', None),
+            ('GET', '/bootstrap', None),
+            ('GET', '/bootstrap?page=2', None),
+            ('GET', '/categories/4/questions', None),
+            ('GET', '/categories/1/questions?after_id=0&limit=2', None),
+            ('GET', '/categories/1000/questions', None),
+            ('PATCH', '/questions', None),
+            ('GET', '/unknown', None),
+            ('POST', '/quizzes', {'previous_questions': []}),
+            ('POST', '/quizzes', {
+                'quiz_category': {'id': 0},
+                'previous_questions': [],
+                'difficulty': 0
+            }),
+            ('POST', '/quizzes', {
+                'quiz_category': {'id': 0},
+                'previous_questions': [],
+                'difficulty': 'hard'
+            }),
+            ('POST', '/quizzes', {
+                'quiz_category': {'id': 0},
+                'previous_questions': [],
+                'difficulty': True
+            }),
+            ('POST', '/quizzes', {
+                'quiz_category': {'id': 0},
+                'previous_questions': [],
+                'ramp': -1
+            }),
+            ('POST', '/quizzes', {
+                'quiz_category': {'id': 1000},
+                'previous_questions': [],
+                'difficulty': 2,
+                'ramp': 3
+            }),
+            ('POST', '/quizzes/sessions', {}),
+            ('POST', '/quizzes/sessions/unknown/next', None)
+        ])
+
+    @unittest.skipUnless(asyncpg, 'asyncpg is not installed')
+    def test_asgi_quizzes(self):
+        app = create_asgi_app(self.database_path)
+        category = {'id': 4, 'type': 'History'}
+
+        async def run():
+            played = []
+            while True:
+                status, data = await asgi_request(app, 'POST', '/quizzes', {
+                    'quiz_category': category,
+                    'previous_questions': played
+                })
+                self.assertEqual(status, 200)
+                if data['question'] is None:
+                    break
+                self.assertEqual(data['question']['category'], 4)
+                self.assertNotIn(data['question']['id'], played)
+                played.append(data['question']['id'])
+            self.assertTrue(played)
+
+            status, data = await asgi_request(
+                app, 'POST', '/quizzes/sessions', {'quiz_category': category}
+            )
+            self.assertEqual(status, 201)
+            self.assertEqual(data['totalQuestions'], len(played))
+            path = f'/quizzes/sessions/{data["session_id"]}'
+            status, data = await asgi_request(app, 'POST', f'{path}/next')
+            self.assertIn(data['question']['id'], played)
+            self.assertEqual(data['remaining'], len(played) - 1)
+            status, data = await asgi_request(app, 'DELETE', path)
+            self.assertEqual(status, 200)
+            await app.database.close()
+
+        asyncio.run(run())
+
+    @unittest.skipUnless(aiosqlite, 'aiosqlite is not installed')
+    def test_asgi_sqlite_stand_in(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'sqlite:///{directory}/trivia.db'
+            app = create_app(test_config={'SEARCH_BACKEND': 'ilike'})
+            setup_db(app, path)
+            with app.app_context():
+                for type in ('Science', 'Art'):
+                    db.session.add(Category(type))
+                db.session.commit()
+                for number in range(12):
+                    Question(f'Question {number}?', 'Yes', number % 2 + 1,
+                             number + 1).insert()
+
+            self.compare_asgi(create_asgi_app(path), app.test_client(), [
+                ('GET', '/categories', None),
+                ('GET', '/questions?page=2', None),
+                ('GET', '/categories/2/questions?after_id=2&limit=2', None),
+                ('POST', '/quizzes', {
+                    'quiz_category': {'id': 1},
+                    'previous_questions': [1, 3, 5, 7, 9, 11]
+                }),
+                # category 1 has the difficulties 1, 3, 5, 7, 9 and 11
+                ('POST', '/quizzes', {
+                    'quiz_category': {'id': 1},
+                    'previous_questions': [],
+                    'difficulty': 5
+                }),
+                ('POST', '/quizzes', {
+                    'quiz_category': {'id': 1},
+                    'previous_questions': [],
+                    'difficulty': 4
+                }),
+                ('POST', '/quizzes', {
+                    'quiz_category': {'id': 1},
+                    'previous_questions': [1, 3],
+                    'difficulty': 1,
+                    'ramp': 2
+                }),
+                ('POST', '/quizzes', {
+                    'quiz_category': {'id': 1},
+                    'previous_questions': [],
+                    'difficulty': 20
+                }),
+                ('POST', '/quizzes', {
+                    'quiz_category': {'id': 1},
+                    'previous_questions': [],
+                    'difficulty': 0
+                }),
+                ('POST', '/quizzes', {
+                    'quiz_category': {'id': 1},
+                    'previous_questions': [],
+                    'ramp': 'fast'
+                })
+            ])
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":